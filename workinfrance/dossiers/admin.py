@@ -4,11 +4,42 @@ from django.utils.translation import ugettext_lazy as _
 
 from prettyjson import PrettyJSONWidget
 
-from workinfrance.dossiers.models import Dossier, DossierPrefecture
+from workinfrance.dossiers.models import Dossier, DossierPayload, DossierPrefecture, Synchronization
+
+
+class DossierPayloadInline(admin.StackedInline):
+    """
+    Raw JSON of a Dossier, displayed in its change page.
+    """
+
+    model = DossierPayload
+    can_delete = False
+
+    formfield_overrides = {
+        JSONField: {'widget': PrettyJSONWidget}
+    }
+
+
+class DossierPayloadAdminMixin:
+    """
+    Display the raw JSON of a Dossier in its change page, see `DossierPayloadInline`.
+    """
+
+    inlines = [DossierPayloadInline]
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # The inline is saved after the Dossier: recompute the fields derived from the new raw JSON.
+        dossier = form.instance
+        try:
+            dossier.payload.refresh_from_db()
+        except DossierPayload.DoesNotExist:
+            return
+        dossier.save()
 
 
 @admin.register(Dossier)
-class DossierAdmin(admin.ModelAdmin):
+class DossierAdmin(DossierPayloadAdminMixin, admin.ModelAdmin):
 
     list_display = (
         'ds_id',
@@ -30,31 +61,37 @@ class DossierAdmin(admin.ModelAdmin):
         JSONField: {'widget': PrettyJSONWidget}
     }
 
+    def get_queryset(self, request):
+        # Only `accompagnateurs` is needed from raw_json in the list.
+        return super().get_queryset(request).defer_raw_json('accompagnateurs')
+
     def created(self, obj):
         return obj.created_at.strftime("%d/%m/%Y %H:%M")
     created.short_description = _("Créé le")
 
-    # The following fields are custom list_display fields that have no DB field, they are not sortable etc.
+    # The following fields are custom list_display fields.
 
     def custom_accompagnateurs(self, obj):
         return obj.accompagnateurs
     custom_accompagnateurs.short_description = _("Accompagnateurs")
 
     def custom_date_de_debut_apt(self, obj):
-        if obj.date_de_debut_apt:
-            return obj.date_de_debut_apt.strftime("%d/%m/%Y")
+        if obj.apt_start_date:
+            return obj.apt_start_date.strftime("%d/%m/%Y")
         return None
     custom_date_de_debut_apt.short_description = _("Début APT")
+    custom_date_de_debut_apt.admin_order_field = 'apt_start_date'
 
     def custom_date_de_fin_apt(self, obj):
-        if obj.date_de_fin_apt:
-            return obj.date_de_fin_apt.strftime("%d/%m/%Y")
+        if obj.apt_end_date:
+            return obj.apt_end_date.strftime("%d/%m/%Y")
         return None
     custom_date_de_fin_apt.short_description = _("Fin APT")
+    custom_date_de_fin_apt.admin_order_field = 'apt_end_date'
 
 
 @admin.register(DossierPrefecture)
-class DossierPrefectureAdmin(admin.ModelAdmin):
+class DossierPrefectureAdmin(DossierPayloadAdminMixin, admin.ModelAdmin):
     """
     List of Dossiers to watch before a renewal in Prefecture.
     Useful to verify whether a dossier was well inspected.
@@ -78,7 +115,8 @@ class DossierPrefectureAdmin(admin.ModelAdmin):
     }
 
     def get_queryset(self, request):
-        return self.model.prefecture_objects.watch_before_renew()
+        # raw_json is not needed in the list.
+        return self.model.prefecture_objects.watch_before_renew().defer_raw_json()
 
     def has_add_permission(self, request):
         # Hide add buttons.
@@ -93,18 +131,19 @@ class DossierPrefectureAdmin(admin.ModelAdmin):
             'title': _("Suivi Préfecture : dossiers à surveiller pour cause de renouvellement proche en Préfecture"),
         })
 
-    # The following fields are custom list_display fields that have no DB field, they are not sortable etc.
+    # The following fields are custom list_display fields.
 
     def custom_expiration_titre_sejour(self, obj):
-        return obj.date_dexpiration_titre_sejour.strftime("%d/%m/%Y")
+        return obj.residence_permit_expiration_date.strftime("%d/%m/%Y")
     custom_expiration_titre_sejour.short_description = _("Date d'expiration du titre de sejour")
     # Allow to sort on custom list_display field.
     # https://stackoverflow.com/a/7448615
-    custom_expiration_titre_sejour.admin_order_field = 'expiration_admin_order'
+    custom_expiration_titre_sejour.admin_order_field = 'residence_permit_expiration_date'
 
     def custom_nationalite(self, obj):
-        return obj.nationalite.title()
+        return obj.nationality.title()
     custom_nationalite.short_description = _("Nationalité")
+    custom_nationalite.admin_order_field = 'nationality'
 
     def custom_nom(self, obj):
         return obj.nom.title()
@@ -113,3 +152,17 @@ class DossierPrefectureAdmin(admin.ModelAdmin):
     def custom_prenom(self, obj):
         return obj.prenom.title()
     custom_prenom.short_description = _("Prénom")
+
+
+@admin.register(Synchronization)
+class SynchronizationAdmin(admin.ModelAdmin):
+
+    list_display = (
+        'started_at',
+        'ended_at',
+        'full',
+        'last_page',
+        'high_water_mark',
+    )
+    list_filter = ['full']
+    ordering = ('-started_at',)
@@ -0,0 +1,82 @@
+"""
+Client for the demarches-simplifiees.fr (DS) API.
+
+https://www.demarches-simplifiees.fr/docs/1.0/
+"""
+import json
+
+from django.conf import settings
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class DemarchesSimplifieesClient:
+    """
+    Wrap a `requests.Session` so that all API calls share a pool of keep-alive connections.
+
+    Transient errors (connection errors, 429 and 5xx responses) are retried with an exponential
+    backoff, honoring the `Retry-After` header when the API sends one.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, base_url=None, procedure_id=None, token=None,
+                 pool_size=None, timeout=None, max_retries=None, backoff_factor=None):
+        base_url = base_url or settings.DS_API_BASE_URL
+        procedure_id = procedure_id or settings.DS_PROCEDURE_ID_APT
+        self.procedure_url = f'{base_url}/procedures/{procedure_id}'
+        self.timeout = timeout or settings.DS_API_TIMEOUT
+
+        retry = Retry(
+            total=settings.DS_API_MAX_RETRIES if max_retries is None else max_retries,
+            backoff_factor=settings.DS_API_BACKOFF_FACTOR if backoff_factor is None else backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            respect_retry_after_header=True,
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size or settings.DS_API_POOL_SIZE,
+            max_retries=retry,
+        )
+
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.session.params = {'token': token or settings.DS_API_TOKEN}
+        self.session.headers.update({'content-type': 'application/json'})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def get(self, url, **kwargs):
+        r = self.session.get(url, timeout=self.timeout, **kwargs)
+        r.raise_for_status()
+        return r.json()
+
+    def get_dossiers_page(self, page, per_page=1000):
+        """
+        Return a page of the list of all the dossiers of the procedure.
+
+        GET /api/v1/procedures/:procedure_id/dossiers
+        """
+        data = {
+            'page': page,
+            'resultats_par_page': per_page,
+        }
+        return self.get(f'{self.procedure_url}/dossiers', data=json.dumps(data))
+
+    def get_dossier(self, dossier_id):
+        """
+        Return the details of a single dossier.
+
+        GET /api/v1/procedures/:procedure_id/dossiers/:id
+        """
+        return self.get(f'{self.procedure_url}/dossiers/{dossier_id}')
@@ -0,0 +1,229 @@
+"""
+Local simulator of the demarches-simplifiees.fr (DS) API, used to benchmark the synchronization.
+
+Only the endpoints used by `DemarchesSimplifieesClient` are simulated:
+
+    GET /api/v1/procedures/:procedure_id/dossiers
+    GET /api/v1/procedures/:procedure_id/dossiers/:id
+
+Dossiers are generated from `raw_dossier.RAW_DOSSIER`. Their values are random but
+only depend on their ID (and the seed): the same dossier is returned by each call.
+"""
+import copy
+import datetime
+import http.server
+import json
+import random
+import re
+import socketserver
+import threading
+import time
+import urllib.parse
+
+from workinfrance.dossiers.models import Dossier
+from workinfrance.dossiers.raw_dossier import RAW_DOSSIER
+
+
+FIRST_DS_ID = 100000
+
+# Dates of the generated dossiers are spread over 2 years from this date.
+START_DATETIME = datetime.datetime(2018, 3, 1, tzinfo=datetime.timezone.utc)
+
+STATUSES_WEIGHTS = {
+    Dossier.STATUS_DRAFT: 5,
+    Dossier.STATUS_INITIATED: 15,
+    Dossier.STATUS_RECEIVED: 10,
+    Dossier.STATUS_CLOSED: 60,
+    Dossier.STATUS_REFUSED: 5,
+    Dossier.STATUS_WITHOUT_CONTINUATION: 5,
+}
+FIRST_NAMES = ['Mohamed', 'Fatima', 'Ahmed', 'Aïcha', 'Youssef', 'Khadija', 'Ali', 'Mariam', 'Omar', 'Sara']
+NATIONALITIES = ['ALGERIE', 'MAROC', 'TUNISIE', 'SENEGAL', 'MALI', 'CHINE', 'INDE', 'BRESIL', None]
+DEPARTMENTS = ['75 - Paris', '92 - Hauts-de-Seine', '93 - Seine-Saint-Denis', '94 - Val-de-Marne', '69 - Rhône']
+
+
+def json_datetime(dt):
+    """Format a datetime like the DS API, e.g. `2018-03-27T08:49:51.491Z`."""
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.') + f'{dt.microsecond // 1000:03d}Z'
+
+
+def random_last_name(rand):
+    """Return a random last name (uppercase letters), using the given `random.Random` instance."""
+    return ''.join(rand.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(rand.randint(3, 12)))
+
+
+def _random(ds_id, seed):
+    rand = random.Random(f'{seed}:{ds_id}')
+    created_at = START_DATETIME + datetime.timedelta(seconds=rand.randint(0, 2 * 365 * 24 * 3600))
+    updated_at = created_at + datetime.timedelta(seconds=rand.randint(60, 30 * 24 * 3600))
+    return rand, created_at, updated_at
+
+
+def generate_listed_dossier(ds_id, seed=0):
+    """
+    Return a dossier as listed by the DS API, see `test/raw_dossiers_fixture.RAW_DOSSIERS`.
+    """
+    _, created_at, updated_at = _random(ds_id, seed)
+    return {'id': ds_id, 'updated_at': json_datetime(updated_at), 'initiated_at': json_datetime(created_at)}
+
+
+def generate_dossier_values(ds_id, seed=0):
+    """
+    Return the random values of a generated dossier, as a tuple of 2 dicts:
+        - the values of `raw_json['dossier']` (`id`, `state`, `created_at`, `updated_at`),
+        - the values of the champs (and champs privés) by `libelle`.
+    Other values are those of `raw_dossier.RAW_DOSSIER`.
+    """
+    rand, created_at, updated_at = _random(ds_id, seed)
+    dossier_values = {
+        'id': ds_id,
+        'state': rand.choices(list(STATUSES_WEIGHTS), weights=list(STATUSES_WEIGHTS.values()))[0],
+        'created_at': json_datetime(created_at),
+        'updated_at': json_datetime(updated_at),
+    }
+    apt_start_date = (updated_at + datetime.timedelta(days=rand.randint(0, 30))).date()
+    champs_values = {
+        'Nom': random_last_name(rand),
+        'Prénom': rand.choice(FIRST_NAMES),
+        'Nationalité': rand.choice(NATIONALITIES),
+        'Date de naissance': (datetime.date(1950, 1, 1) + datetime.timedelta(days=rand.randint(0, 18000))).isoformat(),
+        'Département qui figure sur le titre de séjour': rand.choice(DEPARTMENTS),
+        'Date d’expiration': (apt_start_date + datetime.timedelta(days=rand.randint(30, 700))).isoformat(),
+        'Date de début APT': apt_start_date.isoformat(),
+        'Date de fin APT': (apt_start_date + datetime.timedelta(days=rand.randint(30, 365))).isoformat(),
+    }
+    return dossier_values, champs_values
+
+
+def generate_raw_dossier(ds_id, seed=0):
+    """
+    Return the details of a dossier as returned by the DS API, see `raw_dossier.RAW_DOSSIER`.
+    """
+    dossier_values, champs_values = generate_dossier_values(ds_id, seed)
+    return set_dossier_values(copy.deepcopy(RAW_DOSSIER), dossier_values, champs_values)
+
+
+def set_dossier_values(raw_json, dossier_values, champs_values):
+    """
+    Set the values returned by `generate_dossier_values` in the given `raw_json`. Return `raw_json`.
+    """
+    dossier = raw_json['dossier']
+    dossier.update(dossier_values)
+    for champ in dossier['champs'] + dossier['champs_private']:
+        if champ['type_de_champ']['libelle'] in champs_values:
+            champ['value'] = champs_values[champ['type_de_champ']['libelle']]
+    return raw_json
+
+
+class DemarchesSimplifieesSimulator:
+    """
+    HTTP server simulating the DS API on localhost, in a background thread:
+
+        with DemarchesSimplifieesSimulator(dossiers_count=1000, latency=0.05) as simulator:
+            client = DemarchesSimplifieesClient(base_url=simulator.base_url)
+
+    `latency` (in seconds) is added to each response. A random `error_rate` of the requests
+    fail with a 503 error. Dossiers are listed by pages of `per_page` dossiers if given,
+    otherwise by pages of the size requested by the client.
+    """
+
+    def __init__(self, dossiers_count=1000, per_page=None, latency=0, error_rate=0, seed=0):
+        self.dossiers_ids = range(FIRST_DS_ID, FIRST_DS_ID + dossiers_count)
+        self.per_page = per_page
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.count_requests = 0
+        self.count_errors = 0
+        self.server = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}/api/v1'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), _RequestHandler)
+        self.server.simulator = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def should_fail(self):
+        with self.lock:
+            self.count_requests += 1
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.count_errors += 1
+                return True
+        return False
+
+    def get_dossiers_page(self, page, per_page):
+        per_page = self.per_page or per_page
+        pages_count = max(1, -(-len(self.dossiers_ids) // per_page))
+        return {
+            'dossiers': [
+                generate_listed_dossier(ds_id, self.seed)
+                for ds_id in self.dossiers_ids[(page - 1) * per_page:page * per_page]
+            ],
+            'pagination': {'page': page, 'resultats_par_page': per_page, 'nombre_de_page': pages_count},
+        }
+
+    def get_dossier(self, ds_id):
+        if ds_id not in self.dossiers_ids:
+            return None
+        return generate_raw_dossier(ds_id, self.seed)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+
+    # Keep connections alive, like the real API.
+    protocol_version = 'HTTP/1.1'
+
+    PATH_REGEX = re.compile(r'^/api/v1/procedures/[^/]+/dossiers(?:/(?P<ds_id>\d+))?$')
+
+    def do_GET(self):
+        simulator = self.server.simulator
+        # The client sends the pagination parameters in the body of its GET requests.
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(simulator.latency)
+
+        if simulator.should_fail():
+            return self.send_json(503, {'error': 'Service Unavailable'})
+
+        match = self.PATH_REGEX.match(urllib.parse.urlsplit(self.path).path)
+        if not match:
+            return self.send_json(404, {'error': 'Not Found'})
+        if match.group('ds_id'):
+            data = simulator.get_dossier(int(match.group('ds_id')))
+            if data is None:
+                return self.send_json(404, {'error': 'Not Found'})
+            return self.send_json(200, data)
+        params = json.loads(body) if body else {}
+        data = simulator.get_dossiers_page(int(params.get('page', 1)), int(params.get('resultats_par_page', 100)))
+        return self.send_json(200, data)
+
+    def send_json(self, status, data):
+        content = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
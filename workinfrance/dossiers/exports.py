@@ -0,0 +1,140 @@
+"""
+Helpers to write the exported files.
+"""
+import contextlib
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+# Exported formats, and the extension of their files.
+FORMATS = {
+    'json': '.json',
+    'json.gz': '.json.gz',
+    'columnar': '.columnar.json',
+    'columnar.gz': '.columnar.json.gz',
+}
+
+# Origin of the dates encoded as a number of days in the columnar format.
+EPOCH = datetime.date(1970, 1, 1)
+
+
+@contextlib.contextmanager
+def atomic_write(file_path, compress=False):
+    """
+    Open a temporary text file next to `file_path`, and rename it to `file_path` once fully written.
+    With `compress`, the file is gzipped.
+
+    Readers of `file_path` (e.g. a cron job copying it) never see a partially written file,
+    and the previous file is kept if writing fails.
+    """
+    tmp_file_path = f'{file_path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_file_path, 'wb') as rawfile:
+            fileobj = gzip.GzipFile(fileobj=rawfile, mode='wb', mtime=0) if compress else rawfile
+            outfile = io.TextIOWrapper(fileobj, encoding='utf-8')
+            yield outfile
+            # Closing the wrapper would close `rawfile` too: detach it instead.
+            outfile.flush()
+            outfile.detach()
+            if compress:
+                fileobj.close()
+            rawfile.flush()
+            os.fsync(rawfile.fileno())
+        os.replace(tmp_file_path, file_path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_file_path)
+        raise
+
+
+class JsonArrayWriter:
+    """
+    Write items to `outfile` as a JSON array, one item at a time: the whole list is never built in memory.
+    `close()` must be called once all items are written.
+    """
+
+    def __init__(self, outfile, cls=DjangoJSONEncoder):
+        self.outfile = outfile
+        self.encoder = cls()
+        self.count = 0
+        self.outfile.write('[')
+
+    def write(self, item):
+        if self.count:
+            self.outfile.write(', ')
+        self.outfile.write(self.encoder.encode(item))
+        self.count += 1
+
+    def close(self):
+        self.outfile.write(']')
+
+
+def write_json_array(outfile, items, cls=DjangoJSONEncoder):
+    """
+    Write the given `items` to `outfile` as a JSON array, see `JsonArrayWriter`. `items` can be a generator.
+    Returns the number of items written.
+    """
+    writer = JsonArrayWriter(outfile, cls=cls)
+    for item in items:
+        writer.write(item)
+    writer.close()
+    return writer.count
+
+
+def to_columns(items):
+    """
+    Convert a list of dicts (with the same keys) to a dict of columns, which is smaller to store and faster to parse.
+    Dates are encoded as a number of days since `EPOCH`:
+        {
+            'epoch': '1970-01-01',
+            'count': 2,
+            'columns': {
+                'ds_id': [44950, 44951],
+                'date_de_naissance': [3275, None],
+                …
+            },
+        }
+    """
+    columns = {}
+    count = 0
+    for item in items:
+        for key, value in item.items():
+            if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+                value = (value - EPOCH).days
+            columns.setdefault(key, [None] * count).append(value)
+        count += 1
+    return {'epoch': EPOCH, 'count': count, 'columns': columns}
+
+
+def hash_json(item, cls=DjangoJSONEncoder):
+    """
+    Return a short hash of the JSON encoding of `item`, used to detect changes between two exports.
+    """
+    encoded = json.dumps(item, cls=cls, sort_keys=True)
+    return hashlib.sha1(encoded.encode()).hexdigest()[:16]
+
+
+def read_json(file_path, default=None):
+    """
+    Return the content of the given JSON file, or `default` if the file doesn't exist.
+    """
+    try:
+        with open(file_path) as infile:
+            return json.load(infile)
+    except FileNotFoundError:
+        return default
+
+
+def read_jsonl(file_path):
+    """
+    Yield the values of the given JSON Lines file (one JSON value per line), one line at a time.
+    """
+    with open(file_path, encoding='utf-8') as infile:
+        for line in infile:
+            yield json.loads(line)
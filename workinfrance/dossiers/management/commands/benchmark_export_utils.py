@@ -0,0 +1,65 @@
+import datetime
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from workinfrance.dossiers import utils
+from workinfrance.dossiers.ds_api_simulator import FIRST_NAMES, random_last_name
+
+
+class Command(BaseCommand):
+
+    help = "Compare the per-value and batch versions of the conversions used by the validity check export."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count',
+            type=int,
+            default=100000,
+            help="Number of values converted (default: 100000).",
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help="Number of runs of each benchmark, the best one is reported (default: 3).",
+        )
+
+    def handle(self, *args, **options):
+        rand = random.Random(0)
+        count = options['count']
+        # Like real data, first names repeat a lot while last names and dates are more diverse.
+        first_names = [rand.choice(FIRST_NAMES) for _ in range(count)]
+        last_names = [random_last_name(rand) for _ in range(count)]
+        dates = [
+            (datetime.date(1950, 1, 1) + datetime.timedelta(days=rand.randint(0, 20000))).isoformat()
+            for _ in range(count)
+        ]
+
+        self.compare(
+            'obfuscate (first names)', options['repeat'],
+            lambda: [utils.obfuscate(name) for name in first_names],
+            lambda: utils.obfuscate_many(first_names),
+        )
+        self.compare(
+            'obfuscate (last names)', options['repeat'],
+            lambda: [utils.obfuscate(name) for name in last_names],
+            lambda: utils.obfuscate_many(last_names),
+        )
+        self.compare(
+            'parse dates', options['repeat'],
+            lambda: [utils.json_date_to_python_or_none(date) for date in dates],
+            lambda: utils.parse_dates_many(dates),
+        )
+        self.stdout.write("Done.")
+
+    def compare(self, name, repeat, per_value, batch):
+        if per_value() != batch():
+            raise AssertionError(f"{name}: results differ")
+        per_value_time = min(timeit.repeat(per_value, number=1, repeat=repeat))
+        batch_time = min(timeit.repeat(batch, number=1, repeat=repeat))
+        self.stdout.write(
+            f"{name}: {per_value_time * 1000:.1f} ms one at a time, {batch_time * 1000:.1f} ms in batch, "
+            f"x{per_value_time / batch_time:.1f}"
+        )
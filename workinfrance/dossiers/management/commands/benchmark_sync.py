@@ -0,0 +1,119 @@
+import io
+import time
+import tracemalloc
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+
+from workinfrance.dossiers.ds_api_simulator import DemarchesSimplifieesSimulator
+from workinfrance.test_runner import local_stats_cache_settings
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Run a full synchronization against a local simulator of the demarches-simplifiees.fr API. "
+        "Dossiers are stored in a temporary test DB, destroyed at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dossiers',
+            type=int,
+            default=1000,
+            help="Number of dossiers of the simulated procedure (default: 1000).",
+        )
+        parser.add_argument(
+            '--pages',
+            type=int,
+            default=1,
+            help="Number of pages of the listing of the dossiers (default: 1).",
+        )
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=0.01,
+            help="Latency of the simulated API, in seconds (default: 0.01).",
+        )
+        parser.add_argument(
+            '--error-rate',
+            type=float,
+            default=0,
+            help="Rate of HTTP queries failing with a 503 error, retried by the client (default: 0).",
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help="Seed of the random values of the simulated dossiers (default: 0).",
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help="Passed to sync_dossiers (default: 1).",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help="Passed to sync_dossiers (default: 500).",
+        )
+        parser.add_argument(
+            '--noinput', '--no-input',
+            action='store_false',
+            dest='interactive',
+            help="Destroy an existing test DB without asking for confirmation, like the `test` command.",
+        )
+
+    def handle(self, *args, **options):
+        simulator = DemarchesSimplifieesSimulator(
+            dossiers_count=options['dossiers'],
+            per_page=-(-options['dossiers'] // max(1, options['pages'])) or None,
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+            seed=options['seed'],
+        )
+
+        old_name = connection.settings_dict['NAME']
+        # Like the `test` command, an existing test DB is only destroyed after confirmation (or with --noinput).
+        connection.creation.create_test_db(verbosity=0, autoclobber=not options['interactive'])
+        try:
+            # Stats cached by the application are not touched.
+            with simulator, local_stats_cache_settings(), override_settings(
+                DS_API_BASE_URL=simulator.base_url, DS_API_BACKOFF_FACTOR=0,
+            ):
+                count_queries = 0
+
+                def count_query(execute, sql, params, many, context):
+                    nonlocal count_queries
+                    count_queries += 1
+                    return execute(sql, params, many, context)
+
+                out = io.StringIO()
+                tracemalloc.start()
+                start = time.monotonic()
+                with connection.execute_wrapper(count_query):
+                    call_command(
+                        'sync_dossiers',
+                        '--workers', str(options['workers']),
+                        '--batch-size', str(options['batch_size']),
+                        stdout=out,
+                    )
+                duration = time.monotonic() - start
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(f"""--------------------------------------------------------------------------------
+{options['dossiers']} - number of dossiers synchronized
+{duration:.2f} - duration of the synchronization (seconds)
+{options['dossiers'] / duration:.1f} - number of dossiers synchronized per second
+{simulator.count_requests} - number of HTTP queries received by the simulator
+{simulator.count_errors} - number of HTTP errors returned by the simulator
+{count_queries} - number of DB queries
+{peak_memory / 1024 / 1024:.1f} - peak memory allocated during the synchronization (MB)
+Done.""")
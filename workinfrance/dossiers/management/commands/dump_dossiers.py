@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from workinfrance.dossiers import exports
+from workinfrance.dossiers.models import Dossier
+
+
+class Command(BaseCommand):
+    """
+    Dump the raw JSON of all dossiers, as returned by the demarches-simplifiees.fr API, to a JSONL file
+    (one dossier per line), gzipped if the file name ends with `.gz`.
+
+    The file can be loaded in another DB with `import_dossiers`.
+    """
+
+    help = 'Dump the raw JSON of all dossiers to a JSONL file, see `import_dossiers`.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'file_path',
+            help="Path of the JSONL file, gzipped if it ends with `.gz`.",
+        )
+
+    def handle(self, *args, **options):
+        file_path = options['file_path']
+        count = 0
+        with exports.atomic_write(file_path, compress=file_path.endswith('.gz')) as outfile:
+            raw_jsons = (
+                Dossier.objects.order_by('ds_id').values_list('payload__raw_json', flat=True).iterator(chunk_size=2000)
+            )
+            for raw_json in raw_jsons:
+                outfile.write(json.dumps(raw_json, ensure_ascii=False))
+                outfile.write('\n')
+                count += 1
+
+        self.stdout.write(f"{count} dossiers dumped to {file_path}")
+        self.stdout.write("Done.")
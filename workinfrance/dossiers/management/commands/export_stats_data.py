@@ -7,7 +7,8 @@ from django.core.management.base import BaseCommand
 from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 
-from workinfrance.dossiers.models import Dossier
+from workinfrance.dossiers import exports
+from workinfrance.dossiers.models import DailyStat, Dossier
 
 
 class Command(BaseCommand):
@@ -20,9 +21,22 @@ class Command(BaseCommand):
 
     help = 'Export a JSON file containing the stats data.'
 
+    # Stats are already made of columns (labels and values): columnar formats are not needed.
+    FORMATS = ['json', 'json.gz']
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format',
+            choices=self.FORMATS,
+            default='json',
+            help="Format of the exported file (default: json).",
+        )
+
     def handle(self, *args, **options):
 
-        num_dossiers_day = Dossier.stats_objects.get_num_by_day()
+        stats = DailyStat.objects.get_all_stats()
+
+        num_dossiers_day = stats['num_by_day']
         data_num_dossiers_day = {
             'labels': [d.strftime("%d/%m/%y") for d in num_dossiers_day.keys()],
             'datasets': [
@@ -33,7 +47,7 @@ class Command(BaseCommand):
             ],
         }
 
-        num_dossiers_month = Dossier.stats_objects.get_num_by_month()
+        num_dossiers_month = stats['num_by_month']
         data_num_dossiers_month = {
             'labels': [d.strftime("%m/%y") for d in num_dossiers_month.keys()],
             'datasets': [
@@ -44,7 +58,7 @@ class Command(BaseCommand):
             ],
         }
 
-        num_by_status = Dossier.stats_objects.get_num_by_status()
+        num_by_status = stats['num_by_status']
         data_num_by_status = {
             'labels': [dict(Dossier.STATUS_CHOICES)[item] for item in num_by_status.keys()],
             'datasets': [
@@ -55,7 +69,7 @@ class Command(BaseCommand):
             ],
         }
 
-        num_by_contry = Dossier.stats_objects.get_num_by_country()
+        num_by_contry = stats['num_by_country']
         data_num_by_contry = {
             'labels': [country_name.title() for country_name in num_by_contry.keys()],
             'datasets': [
@@ -66,10 +80,7 @@ class Command(BaseCommand):
             ],
         }
 
-        time_to_process_by_month = (
-            Dossier.stats_objects.filter(status=Dossier.STATUS_CLOSED)
-            .get_time_to_process_by_month()
-        )
+        time_to_process_by_month = stats['time_to_process_by_month']
         data_time_to_process_by_month = {
             'labels': [
                 f'{dt.strftime("%m/%Y")} - {delta.days} jour(s)'
@@ -83,15 +94,20 @@ class Command(BaseCommand):
             ],
         }
 
-        time_to_process = Dossier.stats_objects.filter(status=Dossier.STATUS_CLOSED).get_time_to_process()
-        time_to_process = math.floor(time_to_process.total_seconds() / 60 / 60 / 24)
+        def to_days(duration):
+            if duration is None:
+                return None
+            return math.floor(duration.total_seconds() / 60 / 60 / 24)
 
         data = {
             'data': {
                 'last_update': timezone.now(),
-                'time_to_process': time_to_process,
-                'total_dossiers_closed': Dossier.objects.filter(status=Dossier.STATUS_CLOSED).count(),
-                'total_dossiers': Dossier.objects.all().count(),
+                'time_to_process': to_days(stats['time_to_process']),
+                'time_to_process_median': to_days(stats['time_to_process_median']),
+                'time_to_process_p90': to_days(stats['time_to_process_p90']),
+                'time_to_process_p99': to_days(stats['time_to_process_p99']),
+                'total_dossiers_closed': stats['total_dossiers_closed'],
+                'total_dossiers': stats['total_dossiers'],
             },
             'data_num_dossiers_day': data_num_dossiers_day,
             'data_num_dossiers_month': data_num_dossiers_month,
@@ -100,8 +116,8 @@ class Command(BaseCommand):
             'data_time_to_process_by_month': data_time_to_process_by_month,
         }
 
-        file_path = os.path.join(settings.MEDIA_ROOT, 'stats.json')
-        with open(file_path, 'w') as outfile:
+        file_path = os.path.join(settings.MEDIA_ROOT, f"stats{exports.FORMATS[options['format']]}")
+        with exports.atomic_write(file_path, compress=options['format'].endswith('.gz')) as outfile:
             json.dump(data, outfile, cls=DjangoJSONEncoder)
 
         self.stdout.write("Done.")
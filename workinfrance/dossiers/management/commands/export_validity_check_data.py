@@ -1,21 +1,255 @@
+import contextlib
 import json
 import os
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 
-from workinfrance.dossiers.views import export_data_for_validity_check
+from workinfrance.dossiers import exports
+from workinfrance.dossiers.views import iter_data_for_validity_check
 
 
 class Command(BaseCommand):
+    """
+    Export a JSON file containing the validity check data.
+
+    Each export is described in `validity_check.manifest.json`:
+        {
+            'version': 3,
+            'generated_at': '2018-03-27T09:15:10.780Z',
+            'full': {'version': 1, 'file': 'validity_check.json', 'format': 'json'},
+            'deltas': [
+                {'from_version': 1, 'version': 2, 'file': 'validity_check.delta.2.json'},
+                {'from_version': 2, 'version': 3, 'file': 'validity_check.delta.3.json'},
+            ],
+            'hashes': 'validity_check.hashes.3.jsonl',
+        }
+
+    With `--delta`, only the dossiers added, changed or removed since the previous export are written
+    to a delta file (see `write_delta`). Consumers at version `n` apply the deltas following it,
+    or download the full file if their version is older than the full one.
+    Deltas are computed from the hashes file referenced by the manifest: files of an export that failed
+    before its manifest was written are never used.
+
+    With `--shards N`, the full export is also split into N shard files, the dossier `ds_id`
+    being in the shard `ds_id % N`. Shard files are listed in an index file:
+        {
+            'version': 1,
+            'shards': 16,
+            'files': ['validity_check.shard.0.json', …],
+            'counts': [1093, …],
+        }
+    referenced by the manifest: `'full': {'version': 1, …, 'index': 'validity_check.index.json', 'shards': 16}`.
+    A single dossier can then be checked by downloading the index and one shard.
+
+    With `--format`, files can be gzipped (`json.gz`), and the full export can be written
+    in a columnar format (`columnar`, `columnar.gz`, see `exports.to_columns`).
+    """
 
     help = 'Export a JSON file containing the validity check data.'
 
+    FILE_NAME = 'validity_check{ext}'
+    MANIFEST_FILE_NAME = 'validity_check.manifest.json'
+    # Hashes of the exported dossiers, one `[ds_id, hash]` line per dossier ordered by ds_id,
+    # used to find the dossiers changed since the previous export.
+    HASHES_FILE_NAME = 'validity_check.hashes.{version}.jsonl'
+    DELTA_FILE_NAME = 'validity_check.delta.{version}{ext}'
+    INDEX_FILE_NAME = 'validity_check.index.json'
+    SHARD_FILE_NAME = 'validity_check.shard.{shard}{ext}'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--delta',
+            action='store_true',
+            help="Only export the dossiers changed since the previous export, in a delta file.",
+        )
+        parser.add_argument(
+            '--shards',
+            type=int,
+            default=0,
+            help="Also split the full export into this number of shard files, listed in an index file.",
+        )
+        parser.add_argument(
+            '--format',
+            choices=list(exports.FORMATS),
+            default='json',
+            help="Format of the exported files (default: json). Columnar formats can only be used for full exports.",
+        )
+
     def handle(self, *args, **options):
-        file_path = os.path.join(settings.MEDIA_ROOT, 'validity_check.json')
-        data = export_data_for_validity_check()
-        with open(file_path, 'w') as outfile:
-            json.dump(data, outfile, cls=DjangoJSONEncoder)
-        self.stdout.write(f"{len(data)} dossiers exported.")
+        if options['delta'] and options['shards']:
+            raise CommandError("--shards can only be used with a full export.")
+        if options['shards'] < 0:
+            raise CommandError("--shards must be a positive number.")
+        if options['format'].startswith('columnar') and (options['delta'] or options['shards']):
+            raise CommandError("Columnar formats can only be used with a full export without shards.")
+
+        self.format = options['format']
+        self.compress = self.format.endswith('.gz')
+
+        previous_manifest = exports.read_json(self.path(self.MANIFEST_FILE_NAME))
+        previous_hashes_file_name = previous_manifest.get('hashes') if previous_manifest else None
+        version = previous_manifest['version'] + 1 if previous_manifest else 1
+        hashes_file_name = self.HASHES_FILE_NAME.format(version=version)
+
+        # Hashes are written while dossiers are exported: they are never all in memory.
+        with exports.atomic_write(self.path(hashes_file_name)) as hashes_file:
+            if options['delta'] and previous_hashes_file_name:
+                previous_hashes = exports.read_jsonl(self.path(previous_hashes_file_name))
+                manifest = self.write_delta(dict(previous_manifest), previous_hashes, hashes_file)
+            else:
+                if options['delta']:
+                    self.stdout.write("No previous export: exporting all dossiers.")
+                manifest = self.write_full(previous_manifest, hashes_file, shards=options['shards'])
+
+        if manifest:
+            manifest['hashes'] = hashes_file_name
+            # The manifest is written last: it only references files already written.
+            self.write_manifest(manifest)
+            # Then the files no longer referenced can be removed.
+            if previous_manifest:
+                for file_name in self.referenced_files(previous_manifest) - self.referenced_files(manifest):
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(self.path(file_name))
+        else:
+            os.remove(self.path(hashes_file_name))
         self.stdout.write("Done.")
+
+    def write_manifest(self, manifest):
+        with exports.atomic_write(self.path(self.MANIFEST_FILE_NAME)) as outfile:
+            json.dump(manifest, outfile, cls=DjangoJSONEncoder)
+
+    def path(self, file_name):
+        return os.path.join(settings.MEDIA_ROOT, file_name)
+
+    def referenced_files(self, manifest):
+        files = {manifest['full']['file']}
+        files.update(delta['file'] for delta in manifest['deltas'])
+        if manifest.get('hashes'):
+            files.add(manifest['hashes'])
+        if manifest['full'].get('index'):
+            ext = exports.FORMATS[manifest['full'].get('format', 'json')]
+            files.add(manifest['full']['index'])
+            files.update(
+                self.SHARD_FILE_NAME.format(shard=shard, ext=ext) for shard in range(manifest['full']['shards'])
+            )
+        return files
+
+    def iter_hashed_data(self, hashes_file):
+        """
+        Yield the validity check data (ordered by `ds_id`) with the hash of each item,
+        and write the hashes to `hashes_file`.
+        """
+        for item in iter_data_for_validity_check():
+            item_hash = exports.hash_json(item)
+            hashes_file.write(f'{json.dumps([item["ds_id"], item_hash])}\n')
+            yield item, item_hash
+
+    def write_full(self, manifest, hashes_file, shards=0):
+        """
+        Write all the dossiers to the full file, and to `shards` shard files if needed.
+        Previous deltas are dropped from the manifest.
+        """
+        items = (item for item, item_hash in self.iter_hashed_data(hashes_file))
+        version = manifest['version'] + 1 if manifest else 1
+        ext = exports.FORMATS[self.format]
+        file_name = self.FILE_NAME.format(ext=ext)
+        shard_files = [self.SHARD_FILE_NAME.format(shard=shard, ext=ext) for shard in range(shards)]
+
+        if self.format.startswith('columnar'):
+            # Columns are built in memory: they are much smaller than the list of dicts.
+            columns = exports.to_columns(items)
+            with exports.atomic_write(self.path(file_name), compress=self.compress) as outfile:
+                json.dump(columns, outfile, cls=DjangoJSONEncoder)
+            count = columns['count']
+        else:
+            # All files are written in a single pass over the dossiers.
+            with contextlib.ExitStack() as stack:
+                writer, *shard_writers = [
+                    exports.JsonArrayWriter(
+                        stack.enter_context(exports.atomic_write(self.path(name), compress=self.compress))
+                    )
+                    for name in [file_name] + shard_files
+                ]
+                for item in items:
+                    writer.write(item)
+                    if shards:
+                        shard_writers[item['ds_id'] % shards].write(item)
+                for each_writer in [writer] + shard_writers:
+                    each_writer.close()
+            count = writer.count
+        self.stdout.write(f"{count} dossiers exported.")
+
+        full = {'version': version, 'file': file_name, 'format': self.format}
+        if shards:
+            with exports.atomic_write(self.path(self.INDEX_FILE_NAME)) as outfile:
+                json.dump({
+                    'version': version,
+                    'shards': shards,
+                    'files': shard_files,
+                    'counts': [shard_writer.count for shard_writer in shard_writers],
+                }, outfile)
+            full.update({'index': self.INDEX_FILE_NAME, 'shards': shards})
+            self.stdout.write(f"{shards} shards exported.")
+
+        return {
+            'version': version,
+            'generated_at': timezone.now(),
+            'full': full,
+            'deltas': [],
+        }
+
+    def write_delta(self, manifest, previous_hashes, hashes_file):
+        """
+        Write a delta file with the dossiers added or changed (e.g. `has_expired` flipped) since
+        the previous export, and the IDs of the dossiers removed from the export:
+            {
+                'from_version': 2,
+                'version': 3,
+                'upserts': [{'ds_id': 44950, …}, …],
+                'deletes': [44951, …],
+            }
+        The full file is left untouched. No delta is written if nothing changed.
+
+        `previous_hashes` yields the `[ds_id, hash]` of the previous export ordered by ds_id:
+        it's merged with the dossiers, which are ordered by ds_id too.
+        """
+        version = manifest['version'] + 1
+        file_name = self.DELTA_FILE_NAME.format(version=version, ext=exports.FORMATS[self.format])
+        deletes = []
+
+        def iter_upserts():
+            previous_id, previous_hash = next(previous_hashes, (None, None))
+            for item, item_hash in self.iter_hashed_data(hashes_file):
+                # Previous dossiers before this one are no longer exported.
+                while previous_id is not None and previous_id < item['ds_id']:
+                    deletes.append(previous_id)
+                    previous_id, previous_hash = next(previous_hashes, (None, None))
+                if previous_id == item['ds_id']:
+                    changed = previous_hash != item_hash
+                    previous_id, previous_hash = next(previous_hashes, (None, None))
+                else:
+                    changed = True
+                if changed:
+                    yield item
+            if previous_id is not None:
+                deletes.append(previous_id)
+            deletes.extend(ds_id for ds_id, previous_hash in previous_hashes)
+
+        with exports.atomic_write(self.path(file_name), compress=self.compress) as outfile:
+            outfile.write(f'{{"from_version": {manifest["version"]}, "version": {version}, "upserts": ')
+            count = exports.write_json_array(outfile, iter_upserts())
+            outfile.write(f', "deletes": {json.dumps(deletes)}}}')
+
+        self.stdout.write(f"{count} dossiers exported, {len(deletes)} dossiers removed.")
+        if not count and not deletes:
+            os.remove(self.path(file_name))
+            return None
+
+        delta = {'from_version': manifest['version'], 'version': version, 'file': file_name}
+        manifest['deltas'] = manifest['deltas'] + [delta]
+        manifest['version'] = version
+        manifest['generated_at'] = timezone.now()
+        return manifest
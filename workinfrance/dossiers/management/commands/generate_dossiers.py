@@ -0,0 +1,130 @@
+import copy
+import hashlib
+import json
+import re
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from workinfrance.dossiers import utils
+from workinfrance.dossiers.ds_api_simulator import generate_dossier_values, set_dossier_values
+from workinfrance.dossiers.models import DailyStat, Dossier, DossierPayload
+from workinfrance.dossiers.raw_dossier import RAW_DOSSIER
+
+
+class JsonTemplate:
+    """
+    JSON text split around placeholders, to serialize many similar objects quickly.
+
+    Most of a generated dossier is the same for all dossiers: its JSON text is built by joining the
+    constant parts with the serialized values, instead of serializing the whole object each time.
+    The text is canonical (see `utils.canonical_json`) as long as values are scalars.
+    """
+
+    PLACEHOLDER_REGEX = re.compile(r'"@@(\d+)@@"')
+
+    def __init__(self, obj):
+        """
+        `obj` must contain the placeholders "@@0@@", "@@1@@", … (as string values).
+        """
+        self.parts = self.PLACEHOLDER_REGEX.split(utils.canonical_json(obj))
+
+    def render(self, values):
+        """
+        Return the JSON text of the object, the placeholder "@@n@@" being replaced by `values[n]`.
+        """
+        parts = self.parts[:]
+        for i in range(1, len(parts), 2):
+            parts[i] = json.dumps(values[int(parts[i])], ensure_ascii=False)
+        return ''.join(parts)
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Generate synthetic dossiers (see `ds_api_simulator.generate_dossier_values`) "
+        "and bulk load them with COPY, e.g. for load tests."
+    )
+
+    COLUMNS = [
+        'ds_id', 'status', 'created_at', 'updated_at', 'department', 'champs_json',
+        'nationality', 'residence_permit_expiration_date', 'apt_start_date', 'apt_end_date', 'payload_hash',
+    ]
+    PAYLOAD_COLUMNS = ['dossier_id', 'raw_json']
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'count',
+            type=int,
+            help="Number of dossiers to generate.",
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help="Seed of the random values (default: 0).",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help="Number of dossiers loaded by a single COPY (default: 10000).",
+        )
+
+    def handle(self, *args, **options):
+        # Generated IDs follow the existing ones.
+        first_ds_id = (Dossier.objects.aggregate(max_ds_id=Max('ds_id'))['max_ds_id'] or 0) + 1
+        ds_ids = range(first_ds_id, first_ds_id + options['count'])
+
+        # Placeholders for the generated values, in the order of `generate_dossier_values()`.
+        dossier_values, champs_values = generate_dossier_values(first_ds_id, options['seed'])
+        keys = list(dossier_values) + list(champs_values)
+        placeholders = [f'@@{i}@@' for i in range(len(keys))]
+        raw_json = set_dossier_values(
+            copy.deepcopy(RAW_DOSSIER),
+            dict(zip(dossier_values, placeholders)),
+            dict(zip(champs_values, placeholders[len(dossier_values):])),
+        )
+        raw_json_template = JsonTemplate(raw_json)
+        champs_json_template = JsonTemplate(Dossier.reformat_json_champs(raw_json))
+
+        mapping = Dossier.RAW_JSON_CHAMPS_MAPPING
+        start = time.monotonic()
+        count = 0
+        with transaction.atomic():
+            for batch in utils.chunked(ds_ids, options['batch_size']):
+                rows = []
+                raw_jsons = []
+                for ds_id in batch:
+                    dossier_values, champs_values = generate_dossier_values(ds_id, options['seed'])
+                    values = list(dossier_values.values()) + list(champs_values.values())
+                    raw_json = raw_json_template.render(values)
+                    raw_jsons.append(raw_json)
+                    rows.append((
+                        ds_id,
+                        dossier_values['state'],
+                        dossier_values['created_at'],
+                        dossier_values['updated_at'],
+                        champs_values[mapping['departement_titre_de_sejour']],
+                        champs_json_template.render(values),
+                        champs_values[mapping['nationalite']],
+                        champs_values[mapping['date_dexpiration_titre_sejour']],
+                        champs_values[mapping['date_de_debut_apt']],
+                        champs_values[mapping['date_de_fin_apt']],
+                        hashlib.sha1(raw_json.encode()).hexdigest(),
+                    ))
+                count += Dossier.objects.copy_rows(self.COLUMNS, rows)
+                ids = dict(Dossier.objects.filter(ds_id__in=batch).values_list('ds_id', 'id'))
+                Dossier.objects.copy_rows(
+                    self.PAYLOAD_COLUMNS,
+                    ((ids[ds_id], raw_json) for ds_id, raw_json in zip(batch, raw_jsons)),
+                    table=DossierPayload._meta.db_table,
+                )
+                self.stdout.write(f"{count} dossiers loaded")
+            DailyStat.objects.rebuild()
+
+        duration = time.monotonic() - start
+        self.stdout.write(f"{count} dossiers generated in {duration:.1f}s ({count / (duration or 1):.0f} per second).")
+        self.stdout.write("Done.")
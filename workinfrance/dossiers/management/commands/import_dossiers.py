@@ -0,0 +1,76 @@
+import gzip
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from workinfrance.dossiers import utils
+from workinfrance.dossiers.management.commands.sync_dossiers import Command as SyncCommand
+from workinfrance.dossiers.models import DailyStat, Dossier
+
+
+class Command(BaseCommand):
+    """
+    Import dossiers from a JSONL file of responses of the demarches-simplifiees.fr API (one dossier per line),
+    e.g. written by `dump_dossiers`, instead of fetching them from the API.
+
+    Dossiers are transformed like in `sync_dossiers`, and written by large batches with `COPY`
+    (see `DossierManager.copy_upsert`). A stored dossier is only updated if it changed, see `DossierManager.upsert`.
+    """
+
+    help = 'Import dossiers from a JSONL file of responses of the demarches-simplifiees.fr API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'file_path',
+            help="Path of the JSONL file, gzipped if it ends with `.gz`.",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help="Number of dossiers written to the DB in a single batch (default: 5000).",
+        )
+
+    def handle(self, *args, **options):
+        file_path = options['file_path']
+        count_read = 0
+        count_stored = 0
+        start = time.monotonic()
+
+        opener = gzip.open if file_path.endswith('.gz') else open
+        try:
+            infile = opener(file_path, 'rt', encoding='utf-8')
+        except FileNotFoundError:
+            raise CommandError(f"File not found: {file_path}")
+        with infile:
+            for batch in utils.chunked(self.read_rows(infile), options['batch_size']):
+                count_read += len(batch)
+                with transaction.atomic():
+                    count_stored += Dossier.objects.copy_upsert(batch)
+                    DailyStat.objects.refresh_days(timezone.localtime(row['created_at']).date() for row in batch)
+                self.stdout.write(f"{count_read} dossiers read")
+
+        duration = time.monotonic() - start
+        self.stdout.write(f"""--------------------------------------------------------------------------------
+{count_read} - number of dossiers read
+{count_stored} - number of dossiers written
+{count_read / (duration or 1):.1f} - number of dossiers imported per second
+Done.""")
+
+    def read_rows(self, infile):
+        """
+        Yield the rows to store for each dossier of the given JSONL file.
+        """
+        for line_number, line in enumerate(infile, start=1):
+            if not line.strip():
+                continue
+            try:
+                resp_json = json.loads(line)
+            except ValueError as e:
+                raise CommandError(f"Invalid JSON at line {line_number}: {e}") from e
+            row = SyncCommand.format_for_model(resp_json)
+            row.update(Dossier.derive_fields(resp_json))
+            yield row
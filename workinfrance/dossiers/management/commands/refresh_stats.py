@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from workinfrance.dossiers.models import DailyStat
+
+
+class Command(BaseCommand):
+
+    help = 'Refresh the daily stats rollups from the dossiers stored in the local DB.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help="Recompute all days instead of the days touched since the last refresh.",
+        )
+
+    def handle(self, *args, **options):
+        if options['full']:
+            DailyStat.objects.rebuild()
+            self.stdout.write("All days refreshed.")
+        else:
+            num_days = DailyStat.objects.refresh_since_last()
+            self.stdout.write(f"{num_days} day(s) refreshed.")
+        self.stdout.write("Done.")
@@ -1,118 +1,267 @@
-import json
+import collections
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
-
-import requests
+from django.db import transaction
+from django.utils import timezone
 
 from workinfrance.dossiers import utils
-from workinfrance.dossiers.models import Dossier
+from workinfrance.dossiers.ds_api import DemarchesSimplifieesClient
+from workinfrance.dossiers.models import DailyStat, Dossier, Synchronization
 
 
 class Command(BaseCommand):
 
     help = 'Fetch dossiers from the demarches-simplifiees.fr API and store them in the local DB.'
 
-    API_BASE_URL = f'{settings.DS_API_BASE_URL}/procedures/{settings.DS_PROCEDURE_ID_APT}'
-    API_PAYLOAD = {'token': settings.DS_API_TOKEN}
-    API_HEADERS = {'content-type': 'application/json'}
-
     STATS = {
         'count_dossiers': 0,
+        'count_dossiers_unchanged': 0,
+        'count_dossiers_skipped_unchanged': 0,
         'count_http_queries': 0,
-        'count_update_or_create': 0,
+        'count_stored': 0,
+        'time_storing': 0,
     }
 
+    # Maximum number of IDs in the `IN (…)` clause of a single preload query.
+    PRELOAD_CHUNK_SIZE = 10000
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help="Number of dossiers details fetched concurrently from the API (default: 1).",
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help="Fetch the details of all dossiers, even those unchanged since they were stored.",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help="Number of dossiers written to the DB in a single query (default: 500).",
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help=(
+                "Resume the last synchronization if it was interrupted, after its last processed page. "
+                "The interrupted page is processed again from its start: the dossiers already stored from it "
+                "are listed again, and their details are fetched again if the synchronization is full."
+            ),
+        )
+
     def handle(self, *args, **options):
 
-        dossiers_ids = self.fetch_dossiers_ids()
-        for resp_json in self.fetch_dossiers(dossiers_ids):
-            self.store_dossier(resp_json)
+        # STATS is a class attribute: reset it so that multiple calls in the same process don't add up.
+        self.STATS = dict.fromkeys(self.STATS, 0)
+
+        sync = Synchronization.objects.last_interrupted() if options['resume'] else None
+        if sync:
+            self.stdout.write(f"Resuming the synchronization started at {sync.started_at} after page {sync.last_page}")
+        else:
+            last_sync = None if options['full'] else Synchronization.objects.last_successful()
+            sync = Synchronization.objects.create(full=not last_sync)
+
+        self.batch_size = options['batch_size']
+        self.pending_rows = []
+        self.high_water_mark = sync.high_water_mark
+
+        # Each page of the listing goes through the whole pipeline (fetch details, transform, store)
+        # before the next page is listed. Progress is checkpointed after each page.
+        # Keep at least one pooled connection per worker.
+        pool_size = max(options['workers'], settings.DS_API_POOL_SIZE)
+        with DemarchesSimplifieesClient(pool_size=pool_size) as self.client:
+            for page, items in self.fetch_dossiers_pages(start_page=sync.last_page + 1):
+                self.preload_dossiers([item['id'] for item in items])
+                dossiers_ids = self.filter_changed_dossiers(items, skip_unchanged=not sync.full)
+                for resp_json in self.fetch_dossiers(dossiers_ids, workers=options['workers']):
+                    self.store_dossier(resp_json)
+                self.flush()
+
+                sync.last_page = page
+                sync.high_water_mark = self.high_water_mark
+                sync.save(update_fields=['last_page', 'high_water_mark'])
+
+        sync.high_water_mark = self.high_water_mark
+        sync.ended_at = timezone.now()
+        sync.save()
 
         self.stdout.write(f"""--------------------------------------------------------------------------------
 {self.STATS['count_dossiers']} - number of dossiers checked
+{self.STATS['count_dossiers_unchanged']} - number of dossiers unchanged since the last synchronization
+{self.STATS['count_dossiers_skipped_unchanged']} - number of dossiers fetched but not written because unchanged
 {self.STATS['count_http_queries']} - number of HTTP queries performed
-{self.STATS['count_update_or_create']} - number of dossiers processed
+{self.STATS['count_stored']} - number of dossiers processed
+{self.STATS['count_stored'] / (self.STATS['time_storing'] or 1):.1f} - number of dossiers written per second
 Done.""")
 
-    def fetch_dossiers_ids(self):
+    def fetch_dossiers_pages(self, start_page=1):
         """
-        Fetch all dossiers IDs from the demarches-simplifiees.fr API.
+        Fetch the list of all dossiers from the demarches-simplifiees.fr API, page by page.
+
+        Yield `(page_number, items)` tuples where `items` are the dossiers listed in the page.
         """
-        ALL_DOSSIERS_URL = f'{self.API_BASE_URL}/dossiers'
-        page_current = 1
-        data = {
-            'page': page_current,
-            'resultats_par_page': 1000,
-        }
-        r = requests.get(ALL_DOSSIERS_URL, params=self.API_PAYLOAD, headers=self.API_HEADERS, data=json.dumps(data))
-        resp = r.json()
-        if resp:
-          self.STATS['count_http_queries'] += 1
+        page_current = start_page
+        while True:
+            resp = self.client.get_dossiers_page(page_current)
+            if not resp:
+                return
+            self.STATS['count_http_queries'] += 1
+            self.STATS['count_dossiers'] += len(resp['dossiers'])
 
-          dossiers_ids = [item['id'] for item in resp['dossiers']]
-          self.STATS['count_dossiers'] = len(dossiers_ids)
+            yield page_current, resp['dossiers']
 
-          # The list of all dossiers may have multiple pages. In this case, iterate over other pages.
-          while page_current < resp['pagination']['nombre_de_page']:
-              page_current += 1
-              data['page'] = page_current
+            if page_current >= resp['pagination']['nombre_de_page']:
+                return
+            page_current += 1
 
-              r = requests.get(ALL_DOSSIERS_URL, params=self.API_PAYLOAD, headers=self.API_HEADERS, data=json.dumps(data))
-              resp_json = r.json()
-              self.STATS['count_http_queries'] += 1
+    def filter_changed_dossiers(self, items, skip_unchanged=False):
+        """
+        Return the IDs of the given listing `items`.
 
-              dossiers_ids.extend([item['id'] for item in resp_json['dossiers']])
-              self.STATS['count_dossiers'] = len(dossiers_ids)
+        With `skip_unchanged`, skip the dossiers whose `updated_at` in the listing is not more recent than
+        the `updated_at` of the stored dossier (see `preload_dossiers`): they have not changed since stored.
+        Each dossier is compared to its own stored version rather than to a global cursor: pages are listed
+        at different times, so a dossier changed during a synchronization may be older than the most recent
+        dossier of the listing, and would be missed by the next synchronizations.
+        The most recent `updated_at` of the listing is kept in `self.high_water_mark`, for information.
+        """
+        dossiers_ids = []
+        for item in items:
+            updated_at = None
+            if item.get('updated_at'):
+                updated_at = utils.json_datetime_to_python(item['updated_at'])
+                if not self.high_water_mark or updated_at > self.high_water_mark:
+                    self.high_water_mark = updated_at
+            stored_updated_at = self.updated_at_by_id.get(item['id'])
+            if skip_unchanged and updated_at and stored_updated_at and updated_at <= stored_updated_at:
+                self.STATS['count_dossiers_unchanged'] += 1
+                continue
+            dossiers_ids.append(item['id'])
+        return dossiers_ids
 
-          return dossiers_ids
-        return []
+    def preload_dossiers(self, dossiers_ids):
+        """
+        Load the state of the dossiers already stored in the local DB, so that they can be
+        checked in memory instead of querying the DB for each dossier:
+            self.completed_ids: set of the IDs of the dossiers in a completed state
+            self.updated_at_by_id: dict mapping the IDs of the stored dossiers to their `updated_at`
+            self.payload_hash_by_id: dict mapping the IDs of the stored dossiers to their `payload_hash`
+        """
+        self.completed_ids = set()
+        self.updated_at_by_id = {}
+        self.payload_hash_by_id = {}
+        for chunk in utils.chunked(dossiers_ids, self.PRELOAD_CHUNK_SIZE):
+            for ds_id, status, updated_at, payload_hash in (
+                Dossier.objects
+                .filter(ds_id__in=chunk)
+                .values_list('ds_id', 'status', 'updated_at', 'payload_hash')
+            ):
+                self.updated_at_by_id[ds_id] = updated_at
+                self.payload_hash_by_id[ds_id] = payload_hash
+                if status in Dossier.STATUSES_COMPLETED:
+                    self.completed_ids.add(ds_id)
 
-    def fetch_dossiers(self, dossiers_ids):
+    def fetch_dossiers(self, dossiers_ids, workers=1):
         """
         Fetch dossiers details from the demarches-simplifiees.fr API.
+
+        With `workers` > 1, details are fetched concurrently in a thread pool. The number of
+        in-flight requests is bounded and responses are yielded in the order of `dossiers_ids`.
+        DB queries are kept in the calling thread.
+        """
+        dossiers_ids = self.filter_dossiers_ids(dossiers_ids)
+
+        if workers <= 1:
+            for dossier_id in dossiers_ids:
+                yield self.fetch_dossier(dossier_id)
+            return
+
+        max_in_flight = workers * 2
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = collections.deque()
+            for dossier_id in dossiers_ids:
+                in_flight.append(executor.submit(self.fetch_dossier, dossier_id))
+                if len(in_flight) >= max_in_flight:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+
+    def filter_dossiers_ids(self, dossiers_ids):
+        """
+        Yield the IDs of the dossiers whose details must be fetched.
         """
         for dossier_id in dossiers_ids:
 
             self.stdout.write('-' * 80)
 
-            if Dossier.completed_objects.filter(ds_id=dossier_id).exists():
+            if dossier_id in self.completed_ids:
                 # Don't process a dossier that is already completed.
                 self.stdout.write(f'Dossier {dossier_id} already in a completed state')
                 continue
 
             self.stdout.write(f'Fetching dossier {dossier_id}')
-            DOSSIER_URL = f'{self.API_BASE_URL}/dossiers/{dossier_id}'
-            r = requests.get(DOSSIER_URL, params=self.API_PAYLOAD, headers=self.API_HEADERS)
-            resp_json = r.json()
             self.STATS['count_http_queries'] += 1
+            yield dossier_id
 
-            yield resp_json
+    def fetch_dossier(self, dossier_id):
+        """
+        Fetch a single dossier details from the demarches-simplifiees.fr API.
+        This method may be called from worker threads: it must not touch the DB.
+        """
+        return self.client.get_dossier(dossier_id)
 
     def store_dossier(self, resp_json):
         """
         Store a dossier in the local DB.
+
+        Dossiers are buffered and written by batches of `self.batch_size`, see `flush()`.
+        A stored dossier is not written again if its `raw_json` is unchanged (same `payload_hash`).
         """
         data = self.format_for_model(resp_json)
-        dossier = Dossier.objects.filter(ds_id=data['ds_id']).first()
-
-        if not dossier or data['updated_at'] > dossier.updated_at:
-            self.stdout.write(f"Storing dossier {data['ds_id']}")
-            Dossier.objects.update_or_create(
-                ds_id=data['ds_id'],
-                defaults={
-                    'status': data['status'],
-                    'created_at': data['created_at'],
-                    'updated_at': data['updated_at'],
-                    'department': data['department'],
-                    'raw_json': data['raw_json'],
-                },
-            )
-            self.STATS['count_update_or_create'] += 1
-
-    def format_for_model(self, resp_json):
+        data.update(Dossier.derive_fields(data['raw_json']))
+        if data['ds_id'] in self.updated_at_by_id:
+            if data['payload_hash'] == self.payload_hash_by_id[data['ds_id']]:
+                self.stdout.write(f"Dossier {data['ds_id']} unchanged")
+                self.STATS['count_dossiers_skipped_unchanged'] += 1
+                return
+            stored_updated_at = self.updated_at_by_id[data['ds_id']]
+            if not data['updated_at'] or (stored_updated_at and data['updated_at'] < stored_updated_at):
+                # The stored dossier is more recent.
+                return
+
+        self.stdout.write(f"Storing dossier {data['ds_id']}")
+        self.pending_rows.append(data)
+        self.updated_at_by_id[data['ds_id']] = data['updated_at']
+        self.payload_hash_by_id[data['ds_id']] = data['payload_hash']
+
+        if len(self.pending_rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the pending dossiers to the local DB in a single query, and refresh the stats of their days.
+        """
+        if not self.pending_rows:
+            return
+        start = time.monotonic()
+        with transaction.atomic():
+            self.STATS['count_stored'] += Dossier.objects.upsert(self.pending_rows)
+            DailyStat.objects.refresh_days(timezone.localtime(row['created_at']).date() for row in self.pending_rows)
+        self.STATS['time_storing'] += time.monotonic() - start
+        self.pending_rows = []
+
+    @staticmethod
+    def format_for_model(resp_json):
         """
         Convert the raw JSON response to a format that we can store in the Dossier model.
+        It's also used by `import_dossiers`.
         """
         created_at = utils.json_datetime_to_python(resp_json['dossier']['created_at'])
 
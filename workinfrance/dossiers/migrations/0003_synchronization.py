@@ -0,0 +1,39 @@
+# Generated by Django 2.0.13 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dossiers', '0002_auto_20180430_0929'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Synchronization',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(auto_now_add=True, verbose_name='Début')),
+                ('ended_at', models.DateTimeField(blank=True, help_text="Vide si la synchronisation n'a pas abouti", null=True, verbose_name='Fin')),
+                ('full', models.BooleanField(default=False, verbose_name='Synchronisation complète')),
+                ('high_water_mark', models.DateTimeField(blank=True, help_text='Date de modification la plus récente parmi les dossiers listés par demarches-simplifiees.fr', null=True, verbose_name='Date de modification la plus récente')),
+            ],
+            options={
+                'verbose_name': 'Synchronisation',
+                'verbose_name_plural': 'Synchronisations',
+            },
+        ),
+        migrations.CreateModel(
+            name='DossierPrefecture',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'Dossier (suivi Préfecture)',
+                'verbose_name_plural': 'Dossiers (suivi Préfecture)',
+                'proxy': True,
+                'indexes': [],
+            },
+            bases=('dossiers.dossier',),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 11:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dossiers', '0003_synchronization'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='synchronization',
+            name='last_page',
+            field=models.PositiveIntegerField(default=0, help_text='Dernière page de la liste des dossiers entièrement traitée (point de reprise)', verbose_name='Dernière page traitée'),
+        ),
+    ]
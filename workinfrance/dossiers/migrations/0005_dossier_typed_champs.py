@@ -0,0 +1,34 @@
+# Generated by Django 2.0.13 on 2026-10-18 11:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dossiers', '0004_synchronization_last_page'),
+    ]
+
+    # Indexes are built concurrently in 0007, once the columns are populated.
+    operations = [
+        migrations.AddField(
+            model_name='dossier',
+            name='apt_end_date',
+            field=models.DateField(blank=True, null=True, verbose_name='Date de fin APT'),
+        ),
+        migrations.AddField(
+            model_name='dossier',
+            name='apt_start_date',
+            field=models.DateField(blank=True, null=True, verbose_name='Date de début APT'),
+        ),
+        migrations.AddField(
+            model_name='dossier',
+            name='nationality',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='Nationalité'),
+        ),
+        migrations.AddField(
+            model_name='dossier',
+            name='residence_permit_expiration_date',
+            field=models.DateField(blank=True, null=True, verbose_name="Date d'expiration du titre de séjour"),
+        ),
+    ]
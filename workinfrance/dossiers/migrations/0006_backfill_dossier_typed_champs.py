@@ -0,0 +1,78 @@
+"""
+Populate the typed copies of `champs_json` values added in 0005.
+
+Rows are updated by batches, each batch in its own transaction, so that the table is never locked
+for the whole duration of the migration.
+
+Helpers are copied here instead of being imported from the application: the migration must keep
+doing the same thing when the application changes.
+"""
+import datetime
+
+from django.db import migrations
+
+from psycopg2.extras import execute_values
+
+
+BATCH_SIZE = 1000
+
+
+def keyset_batches(queryset, *fields, size=BATCH_SIZE):
+    """
+    Yield the `values_list('id', *fields)` rows of the given `queryset` by lists of at most `size` rows,
+    each batch being fetched after the last id of the previous one.
+    """
+    last_id = 0
+    while True:
+        batch = list(queryset.filter(id__gt=last_id).order_by('id').values_list('id', *fields)[:size])
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1][0]
+
+
+def json_date_to_python_or_none(json_date):
+    """Convert the given `json_date` to a date object, or return None if it's not a valid JSON date."""
+    try:
+        return datetime.datetime.strptime(json_date, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def backfill_typed_champs(apps, schema_editor):
+    Dossier = apps.get_model('dossiers', 'Dossier')
+    table = Dossier._meta.db_table
+    for batch in keyset_batches(Dossier.objects.all(), 'champs_json'):
+        values = [
+            (
+                pk,
+                champs_json['nationalite'],
+                json_date_to_python_or_none(champs_json['date_dexpiration_titre_sejour']),
+                json_date_to_python_or_none(champs_json['date_de_debut_apt']),
+                json_date_to_python_or_none(champs_json['date_de_fin_apt']),
+            )
+            for pk, champs_json in batch
+        ]
+        with schema_editor.connection.cursor() as cursor:
+            execute_values(cursor, f"""
+                UPDATE {table} SET
+                    nationality = v.nationality,
+                    residence_permit_expiration_date = v.residence_permit_expiration_date,
+                    apt_start_date = v.apt_start_date,
+                    apt_end_date = v.apt_end_date
+                FROM (VALUES %s) AS v (id, nationality, residence_permit_expiration_date, apt_start_date, apt_end_date)
+                WHERE {table}.id = v.id
+            """, values, template='(%s, %s, %s::date, %s::date, %s::date)', page_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('dossiers', '0005_dossier_typed_champs'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_typed_champs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,80 @@
+"""
+Index the typed copies of `champs_json` values added in 0005.
+
+Indexes are built CONCURRENTLY so that the migration doesn't block writes on a live table.
+They have the names and definitions Django gives to `db_index=True` fields, so that later migrations find them.
+"""
+import copy
+
+from django.db import migrations, models
+
+
+TYPED_CHAMPS = ['nationality', 'residence_permit_expiration_date', 'apt_start_date', 'apt_end_date']
+
+
+def index_statements(apps, schema_editor):
+    """
+    Yield the CREATE INDEX statements of the `db_index=True` version of each typed champ.
+    """
+    Dossier = apps.get_model('dossiers', 'Dossier')
+    for field_name in TYPED_CHAMPS:
+        field = copy.copy(Dossier._meta.get_field(field_name))
+        field.db_index = True
+        yield str(schema_editor._create_index_sql(Dossier, [field]))
+        # Varchar columns get a second index for LIKE queries.
+        like_index_sql = schema_editor._create_like_index_sql(Dossier, field)
+        if like_index_sql is not None:
+            yield str(like_index_sql)
+
+
+def create_indexes(apps, schema_editor):
+    for sql in index_statements(apps, schema_editor):
+        schema_editor.execute(sql.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY IF NOT EXISTS', 1))
+
+
+def drop_indexes(apps, schema_editor):
+    for sql in index_statements(apps, schema_editor):
+        name = sql.split()[2]
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+    atomic = False
+
+    dependencies = [
+        ('dossiers', '0006_backfill_dossier_typed_champs'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='dossier',
+                    name='apt_end_date',
+                    field=models.DateField(blank=True, db_index=True, null=True, verbose_name='Date de fin APT'),
+                ),
+                migrations.AlterField(
+                    model_name='dossier',
+                    name='apt_start_date',
+                    field=models.DateField(blank=True, db_index=True, null=True, verbose_name='Date de début APT'),
+                ),
+                migrations.AlterField(
+                    model_name='dossier',
+                    name='nationality',
+                    field=models.CharField(
+                        blank=True, db_index=True, max_length=255, null=True, verbose_name='Nationalité'),
+                ),
+                migrations.AlterField(
+                    model_name='dossier',
+                    name='residence_permit_expiration_date',
+                    field=models.DateField(
+                        blank=True, db_index=True, null=True, verbose_name="Date d'expiration du titre de séjour"),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 2.0.13 on 2026-10-18 11:29
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def populate_daily_stats(apps, schema_editor):
+    # Same query as `DailyStatManager.rebuild()`.
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO dossiers_dailystat (
+                day, status, department, nationality, total, processing_duration_sum, processing_duration_count,
+                refreshed_at
+            )
+            SELECT
+                (created_at AT TIME ZONE %s)::date, status, department, nationality,
+                COUNT(*), SUM(updated_at - created_at), COUNT(updated_at), STATEMENT_TIMESTAMP()
+            FROM dossiers_dossier
+            GROUP BY 1, 2, 3, 4
+        """, [timezone.get_current_timezone_name()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dossiers', '0007_dossier_typed_champs_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True, verbose_name='Jour de création')),
+                ('status', models.CharField(choices=[('draft', 'Brouillon'), ('initiated', 'En construction'), ('received', 'En instruction'), ('closed', 'Accepté'), ('refused', 'Refusé'), ('without_continuation', 'Sans suite')], max_length=50, verbose_name='Statut')),
+                ('department', models.CharField(max_length=255, verbose_name='Département titre de séjour')),
+                ('nationality', models.CharField(blank=True, max_length=255, null=True, verbose_name='Nationalité')),
+                ('total', models.PositiveIntegerField(verbose_name='Nombre de dossiers')),
+                ('processing_duration_sum', models.DurationField(blank=True, null=True, verbose_name='Somme des temps de traitement')),
+                ('processing_duration_count', models.PositiveIntegerField(help_text='Nombre de dossiers ayant une date de modification', verbose_name='Nombre de temps de traitement')),
+                ('refreshed_at', models.DateTimeField(verbose_name='Date de calcul')),
+            ],
+            options={
+                'verbose_name': 'Statistique journalière',
+                'verbose_name_plural': 'Statistiques journalières',
+            },
+        ),
+        migrations.RunPython(populate_daily_stats, migrations.RunPython.noop),
+    ]
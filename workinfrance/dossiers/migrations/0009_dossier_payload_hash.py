@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dossiers', '0008_dailystat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dossier',
+            name='payload_hash',
+            field=models.CharField(blank=True, help_text='Hash SHA-1 de raw_json', max_length=40, null=True, verbose_name='Empreinte du JSON brut'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+"""
+Populate `payload_hash` added in 0009, by batches like 0006.
+
+The helpers are frozen copies of the ones of the application at the time of this migration.
+"""
+import hashlib
+import json
+
+from django.db import migrations
+
+from psycopg2.extras import execute_values
+
+
+BATCH_SIZE = 1000
+
+
+def keyset_batches(queryset, *fields, size=BATCH_SIZE):
+    """
+    Yield the `values_list('id', *fields)` rows of the given `queryset` by lists of at most `size` rows,
+    each batch being fetched after the last id of the previous one.
+    """
+    last_id = 0
+    while True:
+        batch = list(queryset.filter(id__gt=last_id).order_by('id').values_list('id', *fields)[:size])
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1][0]
+
+
+def json_hash(value):
+    """Return the SHA-1 hex digest of the canonical JSON (sorted keys, no whitespace) of `value`."""
+    canonical_json = json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha1(canonical_json.encode()).hexdigest()
+
+
+def backfill_payload_hash(apps, schema_editor):
+    Dossier = apps.get_model('dossiers', 'Dossier')
+    table = Dossier._meta.db_table
+    for batch in keyset_batches(Dossier.objects.all(), 'raw_json'):
+        values = [(pk, json_hash(raw_json)) for pk, raw_json in batch]
+        with schema_editor.connection.cursor() as cursor:
+            execute_values(cursor, f"""
+                UPDATE {table} SET payload_hash = v.payload_hash
+                FROM (VALUES %s) AS v (id, payload_hash)
+                WHERE {table}.id = v.id
+            """, values, page_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('dossiers', '0009_dossier_payload_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_payload_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.0.13 on 2026-10-18 11:49
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dossiers', '0010_backfill_dossier_payload_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DossierPayload',
+            fields=[
+                ('dossier', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='payload', serialize=False, to='dossiers.Dossier', verbose_name='Dossier')),
+                ('raw_json', django.contrib.postgres.fields.jsonb.JSONField(verbose_name='Résultat JSON brut')),
+            ],
+            options={
+                'verbose_name': 'Résultat JSON brut',
+                'verbose_name_plural': 'Résultats JSON bruts',
+            },
+        ),
+        # Allow the reverse migration of 0013 to add the column back before its values are copied back.
+        migrations.AlterField(
+            model_name='dossier',
+            name='raw_json',
+            field=django.contrib.postgres.fields.jsonb.JSONField(null=True, verbose_name='Résultat JSON brut'),
+        ),
+    ]
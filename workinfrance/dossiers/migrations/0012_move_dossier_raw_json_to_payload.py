@@ -0,0 +1,59 @@
+"""
+Copy `Dossier.raw_json` to the `DossierPayload` table created in 0011, by batches like 0006.
+"""
+from django.db import migrations
+
+
+BATCH_SIZE = 1000
+
+
+def keyset_ids(queryset, size=BATCH_SIZE):
+    """
+    Yield the ids of the given `queryset` by lists of at most `size` ids,
+    each batch being fetched after the last id of the previous one. Frozen copy, like in 0006.
+    """
+    last_id = 0
+    while True:
+        ids = list(queryset.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:size])
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def copy_batches(apps, schema_editor, sql):
+    Dossier = apps.get_model('dossiers', 'Dossier')
+    DossierPayload = apps.get_model('dossiers', 'DossierPayload')
+    sql = sql.format(table=Dossier._meta.db_table, payload_table=DossierPayload._meta.db_table)
+    for ids in keyset_ids(Dossier.objects.all()):
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(sql, [ids])
+
+
+def move_raw_json_to_payload(apps, schema_editor):
+    copy_batches(apps, schema_editor, """
+        INSERT INTO {payload_table} (dossier_id, raw_json)
+        SELECT id, raw_json FROM {table} WHERE id = ANY(%s)
+        ON CONFLICT (dossier_id) DO UPDATE SET raw_json = EXCLUDED.raw_json
+    """)
+
+
+def move_raw_json_to_dossier(apps, schema_editor):
+    copy_batches(apps, schema_editor, """
+        UPDATE {table} SET raw_json = p.raw_json
+        FROM {payload_table} AS p
+        WHERE {table}.id = p.dossier_id AND {table}.id = ANY(%s)
+    """)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('dossiers', '0011_dossierpayload'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_raw_json_to_payload, move_raw_json_to_dossier),
+    ]
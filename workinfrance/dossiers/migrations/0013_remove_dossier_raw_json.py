@@ -0,0 +1,15 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dossiers', '0012_move_dossier_raw_json_to_payload'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='dossier',
+            name='raw_json',
+        ),
+    ]
@@ -1,11 +1,14 @@
 import datetime
 
 from django.contrib.postgres.fields import JSONField
-from django.db import models
+from django.db import models, router, transaction
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
+from workinfrance.dossiers import models_attributes
 from workinfrance.dossiers import models_managers
 from workinfrance.dossiers import models_queries
+from workinfrance.dossiers import stats_cache
 from workinfrance.dossiers import utils
 
 
@@ -17,8 +20,18 @@ class Dossier(models.Model):
     """
     Store "dossiers" fetched from demarches-simplifiees.fr.
 
-    Look at `raw_dossier_fixture` to see the structure of the data stored in the `raw_json` field.
+    Look at `raw_dossier` to see the structure of the data stored in the `raw_json` attribute.
+    `raw_json` is the largest value of a Dossier: it's stored in `DossierPayload`, and loaded on first access only.
     Look at `test_reformat_json_champs` to see the structure of the data stored in the `champs_json` field.
+
+    Some subfields of `raw_json` and all the subfields of `champs_json` are accessible as direct attributes
+    of the instance, e.g.:
+        self.email
+        self.accompagnateurs
+        self.date_de_debut_apt
+        self.date_de_fin_apt
+        etc.
+    They are computed on first access, so that instantiating a Dossier stays cheap.
     """
 
     # TPS status names are different between the model and the API.
@@ -90,59 +103,116 @@ class Dossier(models.Model):
     updated_at = models.DateTimeField(_("Date de modification"), blank=True, null=True)
     department = models.CharField(_("Département titre de séjour"), max_length=255, db_index=True,
         help_text=_("Département qui figure sur le titre de séjour"))
-    raw_json = JSONField(_("Résultat JSON brut"))
-    # The raw_json field structure make it difficult to query the values of its `champs`
+    # The following fields are copies of `champs_json` values, with a proper type and an index.
+    nationality = models.CharField(_("Nationalité"), max_length=255, blank=True, null=True, db_index=True)
+    residence_permit_expiration_date = models.DateField(_("Date d'expiration du titre de séjour"),
+        blank=True, null=True, db_index=True)
+    apt_start_date = models.DateField(_("Date de début APT"), blank=True, null=True, db_index=True)
+    apt_end_date = models.DateField(_("Date de fin APT"), blank=True, null=True, db_index=True)
+    # Used to skip writing a dossier whose `raw_json` is unchanged.
+    payload_hash = models.CharField(_("Empreinte du JSON brut"), max_length=40, blank=True, null=True,
+        help_text=_("Hash SHA-1 de raw_json"))
+    # The raw_json structure make it difficult to query the values of its `champs`
     # and `champs_private` subfields. The following field is used to facilitate queries.
     champs_json = JSONField(_("Champs et champs privés"),
         help_text=_("Champs et champs privés extraits de raw_json et reformatés"))
 
-    objects = models.Manager()
-    completed_objects = models_managers.CompletedManager()
+    objects = models_managers.DossierManager.from_queryset(models_queries.DossierQueries)()
+    completed_objects = models_managers.CompletedManager.from_queryset(models_queries.DossierQueries)()
     stats_objects = models_queries.StatsQueries.as_manager()
     prefecture_objects = models_queries.PrefectureQueries.as_manager()
 
+    # Subfields of raw_json accessible as direct attributes of the instance.
+    # Subfields of champs_json are added after the class definition, e.g. `self.date_de_fin_apt`.
+    email = models_attributes.RawJsonAttribute('email')  # Email of the applicant.
+    accompagnateurs = models_attributes.RawJsonAttribute('accompagnateurs')  # Array of all "accompagnateurs".
+    entreprise = models_attributes.RawJsonAttribute('entreprise')
+    etablissement = models_attributes.RawJsonAttribute('etablissement')
+    pieces_justificatives = models_attributes.RawJsonAttribute('pieces_justificatives')
+
     def __init__(self, *args, **kwargs):
-        """
-        Make some JSONField subfields of raw_json accessible as direct attributes of the instance, e.g.:
-            self.email
-            self.accompagnateurs
-            self.date_de_debut_apt
-            self.date_de_fin_apt
-            etc.
-        """
         super().__init__(*args, **kwargs)
-
-        RAW_JSON_MAPPING = [
-            'email',  # Email of the applicant.
-            'accompagnateurs',  # Array of all "accompagnateurs".
-            'entreprise',
-            'etablissement',
-            'pieces_justificatives'
-        ]
-        for property_name in RAW_JSON_MAPPING:
-            if property_name in self.raw_json['dossier']:
-              setattr(self, property_name, self.raw_json['dossier'][property_name])
-
         # No pk means that the object is being created: champs_json has not been populated
         # because save() has not yet been called.
         if not self.pk:
             self.champs_json = self.reformat_json_champs(self.raw_json)
 
-        for key in self.RAW_JSON_CHAMPS_MAPPING:
-            try:
-                # Try to convert JSON dates to Python dates.
-                # This is useful e.g. when the attribute is used in Django admin.
-                value = utils.json_date_to_python(self.champs_json[key])
-            except (TypeError, ValueError):
-                value = self.champs_json[key]
-            setattr(self, key, value)
-
     def __str__(self):
         return str(self.ds_id)
 
+    @property
+    def raw_json(self):
+        """
+        Raw JSON of the dossier, read from `DossierPayload` (with an extra query on first access).
+
+        It can be replaced or changed in place: `save()` writes the payload when its hash changed.
+        """
+        try:
+            return self.payload.raw_json
+        except DossierPayload.DoesNotExist:
+            return None
+
+    @raw_json.setter
+    def raw_json(self, value):
+        self.payload = DossierPayload(raw_json=value)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The rollups of the stored day must be refreshed too if `created_at` is changed.
+        instance._stored_created_at = instance.__dict__.get('created_at')
+        return instance
+
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
-        self.champs_json = self.reformat_json_champs(self.raw_json)
-        super().save(force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        stored_payload_hash = self.payload_hash
+        for field_name, value in self.derive_fields(self.raw_json).items():
+            setattr(self, field_name, value)
+        using = using or router.db_for_write(self.__class__, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(
+                force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+            if self.payload_hash != stored_payload_hash:
+                # The payload may have been created before the Dossier had a pk.
+                self.payload.dossier = self
+                self.payload.save(force_insert=force_insert, using=using)
+            self.refresh_daily_stats(using, getattr(self, '_stored_created_at', None), self.created_at)
+        self._stored_created_at = self.created_at
+        stats_cache.bump_data_version(using=using)
+
+    def delete(self, using=None, keep_parents=False):
+        using = using or router.db_for_write(self.__class__, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            result = super().delete(using=using, keep_parents=keep_parents)
+            self.refresh_daily_stats(using, self.created_at)
+        stats_cache.bump_data_version(using=using)
+        return result
+
+    @staticmethod
+    def refresh_daily_stats(using, *created_ats):
+        """
+        Recompute the rollups (see `DailyStat`) of the days of the given creation dates.
+        """
+        DailyStat.objects.db_manager(using).refresh_days(
+            timezone.localtime(created_at).date() for created_at in created_ats if created_at is not None
+        )
+
+    @staticmethod
+    def derive_fields(raw_json):
+        """
+        Return a dict of the fields values computed from the given `raw_json`.
+        It's used by `save()` and by bulk writes that bypass `save()`.
+        """
+        champs_json = Dossier.reformat_json_champs(raw_json)
+        return {
+            'champs_json': champs_json,
+            'nationality': champs_json['nationalite'],
+            'residence_permit_expiration_date': utils.json_date_to_python_or_none(
+                champs_json['date_dexpiration_titre_sejour']
+            ),
+            'apt_start_date': utils.json_date_to_python_or_none(champs_json['date_de_debut_apt']),
+            'apt_end_date': utils.json_date_to_python_or_none(champs_json['date_de_fin_apt']),
+            'payload_hash': utils.json_hash(raw_json),
+        }
 
     @staticmethod
     def reformat_json_champs(raw_json):
@@ -168,6 +238,89 @@ class Dossier(models.Model):
           return True
 
 
+# Make the champs_json subfields accessible as direct attributes of the instance. Values are computed lazily.
+for attribute_name in Dossier.RAW_JSON_CHAMPS_MAPPING:
+    setattr(Dossier, attribute_name, models_attributes.ChampsJsonAttribute(attribute_name))
+
+
+class DossierPayload(models.Model):
+    """
+    Raw JSON of a Dossier, as returned by the demarches-simplifiees.fr API, see `Dossier.raw_json`.
+
+    It's kept out of the Dossier table so that queries on Dossiers don't read it: it's only needed
+    to display a dossier or to recompute its derived fields.
+    """
+
+    dossier = models.OneToOneField(Dossier, on_delete=models.CASCADE, primary_key=True, related_name='payload',
+        verbose_name=_("Dossier"))
+    raw_json = JSONField(_("Résultat JSON brut"))
+
+    class Meta:
+        verbose_name = _("Résultat JSON brut")
+        verbose_name_plural = _("Résultats JSON bruts")
+
+    def __str__(self):
+        return str(self.dossier_id)
+
+
+class DailyStat(models.Model):
+    """
+    Daily rollup of Dossiers: number of Dossiers created each day by status, department and nationality.
+
+    Stats are computed from this table instead of scanning all Dossiers. It is maintained incrementally:
+    the days of the Dossiers saved, updated or deleted through the ORM are recomputed in the same transaction,
+    the days of the Dossiers stored by `sync_dossiers` are recomputed after each batch,
+    and the `refresh_stats` command recomputes all days (`--full`) or the days touched since the last refresh.
+    """
+
+    day = models.DateField(_("Jour de création"), db_index=True)
+    status = models.CharField(_("Statut"), max_length=50, choices=Dossier.STATUS_CHOICES)
+    department = models.CharField(_("Département titre de séjour"), max_length=255)
+    nationality = models.CharField(_("Nationalité"), max_length=255, blank=True, null=True)
+    total = models.PositiveIntegerField(_("Nombre de dossiers"))
+    processing_duration_sum = models.DurationField(_("Somme des temps de traitement"), blank=True, null=True)
+    processing_duration_count = models.PositiveIntegerField(_("Nombre de temps de traitement"),
+        help_text=_("Nombre de dossiers ayant une date de modification"))
+    refreshed_at = models.DateTimeField(_("Date de calcul"))
+
+    objects = models_managers.DailyStatManager.from_queryset(models_queries.DailyStatQueries)()
+
+    class Meta:
+        verbose_name = _("Statistique journalière")
+        verbose_name_plural = _("Statistiques journalières")
+
+    def __str__(self):
+        return f'{self.day} {self.status} {self.department} {self.nationality}: {self.total}'
+
+
+class Synchronization(models.Model):
+    """
+    Keep track of the runs of the `sync_dossiers` command.
+
+    A run following a successful one only fetches the details of the dossiers whose `updated_at`
+    in the listing is more recent than the stored one. The high water mark is kept for information.
+    `last_page` is a checkpoint used to resume an interrupted run.
+    """
+
+    started_at = models.DateTimeField(_("Début"), auto_now_add=True)
+    ended_at = models.DateTimeField(_("Fin"), blank=True, null=True,
+        help_text=_("Vide si la synchronisation n'a pas abouti"))
+    full = models.BooleanField(_("Synchronisation complète"), default=False)
+    last_page = models.PositiveIntegerField(_("Dernière page traitée"), default=0,
+        help_text=_("Dernière page de la liste des dossiers entièrement traitée (point de reprise)"))
+    high_water_mark = models.DateTimeField(_("Date de modification la plus récente"), blank=True, null=True,
+        help_text=_("Date de modification la plus récente parmi les dossiers listés par demarches-simplifiees.fr"))
+
+    objects = models_managers.SynchronizationManager()
+
+    class Meta:
+        verbose_name = _("Synchronisation")
+        verbose_name_plural = _("Synchronisations")
+
+    def __str__(self):
+        return str(self.started_at)
+
+
 class DossierPrefecture(Dossier):
     """
     Use a proxy model to customize the Django admin.
@@ -0,0 +1,47 @@
+from workinfrance.dossiers import utils
+
+
+class RawJsonAttribute:
+    """
+    Give access to `raw_json['dossier'][name]` as a direct attribute of a Dossier.
+
+    The value is read on first access only and then cached in the instance `__dict__`,
+    which takes precedence over this (non-data) descriptor.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            value = instance.raw_json['dossier'][self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+        instance.__dict__[self.name] = value
+        return value
+
+
+class ChampsJsonAttribute:
+    """
+    Give access to `champs_json[name]` as a direct attribute of a Dossier.
+
+    JSON dates are converted to Python dates. This is useful e.g. when the attribute is used in Django admin.
+    The conversion is done on first access only and the result is cached in the instance `__dict__`,
+    which takes precedence over this (non-data) descriptor.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance.champs_json[self.name]
+        try:
+            value = utils.json_date_to_python(value)
+        except (TypeError, ValueError):
+            pass
+        instance.__dict__[self.name] = value
+        return value
@@ -1,7 +1,294 @@
-from django.db import models
+import datetime
+import io
+import json
+
+from django.db import connections, models, transaction
+from django.utils import timezone
+
+from psycopg2.extras import execute_values
+
+from workinfrance.dossiers import stats_cache
+
+
+class DossierManager(models.Manager):
+
+    def upsert(self, rows):
+        """
+        Insert or update the given rows in a single `INSERT … ON CONFLICT` query keyed on `ds_id`.
+
+        `rows` is a list of dicts mapping field names to values, all with the same keys. Unlike `save()`,
+        derived fields are not computed: `champs_json` and `payload_hash` must be included.
+        An already stored dossier is only updated when the row has a different `payload_hash`
+        and an `updated_at` at least as recent.
+        If rows include `raw_json`, the `DossierPayload` of the inserted or updated rows are written too.
+
+        Returns the number of inserted or updated rows.
+        """
+        if not rows:
+            return 0
+
+        # A single `INSERT … ON CONFLICT` can't affect the same row twice: keep the last row of each ds_id.
+        rows = list({row['ds_id']: row for row in rows}.values())
+
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        table = quote_name(self.model._meta.db_table)
+        fields = [self.model._meta.get_field(name) for name in rows[0] if name != 'raw_json']
+        columns = [quote_name(field.column) for field in fields]
+
+        sql = f"""
+            INSERT INTO {table} ({', '.join(columns)}) VALUES %s
+            {self._on_conflict_sql(columns)}
+            RETURNING {quote_name('ds_id')}, {quote_name('id')}
+        """
+        values = [
+            [field.get_db_prep_save(row[field.name], connection) for field in fields]
+            for row in rows
+        ]
+        with transaction.atomic(using=self.db), connection.cursor() as cursor:
+            # A single page is sent: all the inserted or updated rows are returned.
+            execute_values(cursor, sql, values, page_size=len(values))
+            ids = dict(cursor.fetchall())
+            if 'raw_json' in rows[0]:
+                self._upsert_payloads(cursor, [
+                    (ids[row['ds_id']], row['raw_json']) for row in rows if row['ds_id'] in ids
+                ])
+        if ids:
+            stats_cache.bump_data_version(using=self.db)
+        return len(ids)
+
+    def _upsert_payloads(self, cursor, values):
+        """
+        Insert or update the `DossierPayload` of the given `(dossier_id, raw_json)` tuples.
+        """
+        if not values:
+            return
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        payload_model = self.model._meta.get_field('payload').related_model
+        field = payload_model._meta.get_field('raw_json')
+        payload_table = quote_name(payload_model._meta.db_table)
+        dossier_id, raw_json = quote_name('dossier_id'), quote_name('raw_json')
+        sql = f"""
+            INSERT INTO {payload_table} ({dossier_id}, {raw_json}) VALUES %s
+            ON CONFLICT ({dossier_id}) DO UPDATE SET {raw_json} = EXCLUDED.{raw_json}
+        """
+        values = [(pk, field.get_db_prep_save(value, connection)) for pk, value in values]
+        execute_values(cursor, sql, values, page_size=len(values))
+
+    def copy_upsert(self, rows):
+        """
+        Same as `upsert()`, for large batches: rows are loaded with `COPY` in a temporary staging table,
+        then merged into the table of the model (and `DossierPayload`) with a single query.
+
+        Returns the number of inserted or updated rows.
+        """
+        if not rows:
+            return 0
+
+        rows = list({row['ds_id']: row for row in rows}.values())
+
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        table = quote_name(self.model._meta.db_table)
+        staging_table = quote_name(f'{self.model._meta.db_table}_staging')
+        names = list(rows[0])
+        db_columns = [name if name == 'raw_json' else self.model._meta.get_field(name).column for name in names]
+        columns = [quote_name(column) for column in db_columns if column != 'raw_json']
+
+        merge_sql = f"""
+            INSERT INTO {table} ({', '.join(columns)})
+            SELECT {', '.join(columns)} FROM {staging_table}
+            {self._on_conflict_sql(columns)}
+        """
+        if 'raw_json' in names:
+            payload_table = quote_name(self.model._meta.get_field('payload').related_model._meta.db_table)
+            merge_sql = f"""
+                WITH merged AS ({merge_sql} RETURNING {quote_name('ds_id')}, {quote_name('id')})
+                INSERT INTO {payload_table} ({quote_name('dossier_id')}, {quote_name('raw_json')})
+                SELECT merged.{quote_name('id')}, {staging_table}.{quote_name('raw_json')}
+                FROM merged JOIN {staging_table} USING ({quote_name('ds_id')})
+                ON CONFLICT ({quote_name('dossier_id')}) DO UPDATE SET
+                    {quote_name('raw_json')} = EXCLUDED.{quote_name('raw_json')}
+            """
+
+        with transaction.atomic(using=self.db), connection.cursor() as cursor:
+            # Only the loaded columns, without defaults: the `id` sequence is only used by the merge.
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE {staging_table} AS SELECT {", ".join(columns)} FROM {table} WITH NO DATA')
+            if 'raw_json' in names:
+                cursor.execute(f'ALTER TABLE {staging_table} ADD COLUMN {quote_name("raw_json")} jsonb NOT NULL')
+            self.copy_rows(db_columns, ([row[name] for name in names] for row in rows), table=staging_table)
+            cursor.execute(merge_sql)
+            count = cursor.rowcount
+            cursor.execute(f'DROP TABLE {staging_table}')
+        if count:
+            stats_cache.bump_data_version(using=self.db)
+        return count
+
+    def _on_conflict_sql(self, columns):
+        """
+        Return the `ON CONFLICT` clause of the upserts: a stored dossier is only updated when its `raw_json`
+        changed (see `payload_hash`), and by a dossier at least as recent.
+        """
+        quote_name = connections[self.db].ops.quote_name
+        table = quote_name(self.model._meta.db_table)
+        updated_at = quote_name(self.model._meta.get_field('updated_at').column)
+        payload_hash = quote_name(self.model._meta.get_field('payload_hash').column)
+        return f"""
+            ON CONFLICT ({quote_name('ds_id')}) DO UPDATE SET
+                {', '.join(f'{column} = EXCLUDED.{column}' for column in columns)}
+            WHERE EXCLUDED.{payload_hash} IS DISTINCT FROM {table}.{payload_hash}
+                AND ({table}.{updated_at} IS NULL OR EXCLUDED.{updated_at} >= {table}.{updated_at})
+        """
+
+    def copy_rows(self, columns, rows, table=None):
+        """
+        Bulk load the given rows with `COPY … FROM STDIN`, much faster than `INSERT` for large volumes.
+
+        `rows` is an iterable of tuples of values in the order of the given `columns` (names of DB columns).
+        Values of JSON columns can be given as dicts or already serialized as strings.
+        Rows are written to the table of the model, or to the given `table` (e.g. a staging table).
+        Rows are buffered in memory before being sent: large volumes must be split in batches.
+        Cached stats are invalidated when rows are written to the table of the model.
+        Returns the number of rows written.
+        """
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        buffer = io.StringIO()
+        count = 0
+        for row in rows:
+            buffer.write('\t'.join(_copy_text(value) for value in row))
+            buffer.write('\n')
+            count += 1
+        buffer.seek(0)
+        sql = f"""
+            COPY {quote_name(table or self.model._meta.db_table)} ({', '.join(quote_name(c) for c in columns)})
+            FROM STDIN
+        """
+        with connection.cursor() as cursor:
+            cursor.copy_expert(sql, buffer)
+        if count and table is None:
+            stats_cache.bump_data_version(using=self.db)
+        return count
+
+
+def _copy_text(value):
+    """
+    Return the given value in the text format of `COPY`.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    elif isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.isoformat()
+    else:
+        value = str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
 
 
 class CompletedManager(models.Manager):
 
     def get_queryset(self):
         return super().get_queryset().filter(status__in=self.model.STATUSES_COMPLETED)
+
+
+class DailyStatManager(models.Manager):
+
+    def refresh_days(self, days):
+        """
+        Recompute the stats of the given days (an iterable of dates) from the Dossiers.
+
+        Only the Dossiers created during those days are scanned: each run of consecutive days is a range
+        of `created_at` (in the current time zone), and ranges are OR-ed so that the index is used for each.
+        """
+        days = sorted(set(days))
+        if not days:
+            return
+        ranges = []
+        for day in days:
+            if ranges and ranges[-1][1] == day:
+                ranges[-1][1] = day + datetime.timedelta(days=1)
+            else:
+                ranges.append([day, day + datetime.timedelta(days=1)])
+        self._refresh(
+            'WHERE ' + ' OR '.join(['(created_at >= %s AND created_at < %s)'] * len(ranges)),
+            [
+                timezone.make_aware(datetime.datetime.combine(day, datetime.time()))
+                for day_range in ranges
+                for day in day_range
+            ],
+            delete_filter={'day__in': days},
+        )
+
+    def refresh_since_last(self):
+        """
+        Recompute the stats of the days of the Dossiers created or updated since the last refresh.
+        Returns the number of days recomputed.
+
+        Writes through the ORM and `sync_dossiers` refresh their days themselves: this catches up with
+        Dossiers written by other means (e.g. SQL), based on their `created_at` and `updated_at` dates.
+        """
+        from workinfrance.dossiers.models import Dossier
+        last_refresh = self.aggregate(last_refresh=models.Max('refreshed_at'))['last_refresh']
+        if last_refresh is None:
+            self.rebuild()
+            return self.values('day').distinct().count()
+        days = set(
+            timezone.localtime(created_at).date()
+            for created_at in (
+                Dossier.objects
+                .filter(models.Q(created_at__gte=last_refresh) | models.Q(updated_at__gte=last_refresh))
+                .values_list('created_at', flat=True)
+                .iterator()
+            )
+        )
+        self.refresh_days(days)
+        return len(days)
+
+    def rebuild(self):
+        """
+        Recompute the stats of all days from the Dossiers.
+        """
+        self._refresh('', [], delete_filter={})
+
+    def _refresh(self, where, params, delete_filter):
+        from workinfrance.dossiers.models import Dossier
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        sql = f"""
+            INSERT INTO {quote_name(self.model._meta.db_table)} (
+                day, status, department, nationality, total, processing_duration_sum, processing_duration_count,
+                refreshed_at
+            )
+            SELECT
+                (created_at AT TIME ZONE %s)::date, status, department, nationality,
+                COUNT(*), SUM(updated_at - created_at), COUNT(updated_at), STATEMENT_TIMESTAMP()
+            FROM {quote_name(Dossier._meta.db_table)}
+            {where}
+            GROUP BY 1, 2, 3, 4
+        """
+        with transaction.atomic(using=self.db):
+            self.filter(**delete_filter).delete()
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [timezone.get_current_timezone_name()] + params)
+        stats_cache.bump_data_version(using=self.db)
+
+
+class SynchronizationManager(models.Manager):
+
+    def last_successful(self):
+        """
+        Return the last Synchronization that ended successfully, or None.
+        """
+        return self.filter(ended_at__isnull=False).order_by('-started_at').first()
+
+    def last_interrupted(self):
+        """
+        Return the last Synchronization if it did not end, or None.
+        """
+        sync = self.order_by('-started_at').first()
+        if sync and not sync.ended_at:
+            return sync
+        return None
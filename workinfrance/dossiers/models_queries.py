@@ -1,17 +1,111 @@
 import datetime
 
-from django.contrib.postgres.fields.jsonb import KeyTextTransform
-from django.db import models
-from django.db.models import Count, Sum
+from django.contrib.postgres.fields import JSONField
+from django.db import connections, models, transaction
+from django.db.models import Aggregate, Avg, Count, Sum
 from django.db.models.expressions import F, ExpressionWrapper
 from django.db.models.expressions import RawSQL, OrderBy
 from django.db.models.functions import TruncDate, TruncMonth
 from django.utils import timezone
 
+from workinfrance.dossiers import stats_cache
 from workinfrance.dossiers import utils
+from workinfrance.dossiers.stats_cache import cached_stats
 
 
-class PrefectureQueries(models.QuerySet):
+# Fields of the Dossiers that are aggregated in the rollups (see `DailyStat`).
+ROLLUP_FIELDS = {'created_at', 'updated_at', 'status', 'department', 'nationality'}
+
+PROCESSING_DURATION = ExpressionWrapper(F('updated_at') - F('created_at'), output_field=models.DurationField())
+
+
+class PercentileCont(Aggregate):
+    """
+    Continuous percentile (interpolated if needed) of the values of the given expression.
+    https://www.postgresql.org/docs/current/static/functions-aggregate.html#FUNCTIONS-ORDEREDSET-TABLE
+    """
+    function = 'PERCENTILE_CONT'
+    name = 'PercentileCont'
+    template = '%(function)s(%(percentile)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+
+    def __init__(self, expression, percentile, **extra):
+        super().__init__(expression, percentile=float(percentile), **extra)
+
+
+class DossierQueries(models.QuerySet):
+
+    def defer_raw_json(self, *keys):
+        """
+        Load the given keys of `raw_json['dossier']` with the Dossiers, without the whole (large) `raw_json`.
+
+        `raw_json` is stored in `DossierPayload`, and is never loaded by Dossier queries.
+        Keys are annotated under their own name: the corresponding Dossier attributes (e.g. `accompagnateurs`)
+        are read from the annotation instead of `raw_json`, which would be loaded with an extra query.
+        """
+        quote_name = connections[self.db].ops.quote_name
+        payload_table = quote_name(self.model._meta.get_field('payload').related_model._meta.db_table)
+        table = quote_name(self.model._meta.db_table)
+        # Nested KeyTransforms can't be used here: their list parameter breaks `count()` in Django 2.0.
+        return self.annotate(**{
+            key: RawSQL(
+                f"(SELECT raw_json->'dossier'->%s FROM {payload_table} WHERE dossier_id = {table}.id)",
+                (key,),
+                output_field=JSONField(),
+            )
+            for key in keys
+        })
+
+    def delete(self):
+        """
+        Delete the Dossiers (e.g. the "delete selected" admin action), refresh the rollups of their days
+        and invalidate the cached stats.
+        """
+        days = self._created_days()
+        with transaction.atomic(using=self.db, savepoint=False):
+            result = super().delete()
+            self._refresh_daily_stats(days)
+        stats_cache.bump_data_version(using=self.db)
+        return result
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def update(self, **kwargs):
+        """
+        Update the Dossiers, refresh the rollups of their days if needed and invalidate the cached stats.
+        """
+        if not ROLLUP_FIELDS.intersection(kwargs):
+            count = super().update(**kwargs)
+        else:
+            pks = list(self.values_list('pk', flat=True))
+            days = self._created_days()
+            with transaction.atomic(using=self.db, savepoint=False):
+                count = super().update(**kwargs)
+                if 'created_at' in kwargs:
+                    days += type(self)(self.model, using=self.db).filter(pk__in=pks)._created_days()
+                self._refresh_daily_stats(days)
+        if count:
+            stats_cache.bump_data_version(using=self.db)
+        return count
+    update.alters_data = True
+
+    def _created_days(self):
+        """
+        Distinct (local) creation days of the Dossiers.
+        """
+        return list(
+            self
+            .order_by()
+            .annotate(day=TruncDate('created_at'))
+            .values_list('day', flat=True)
+            .distinct()
+        )
+
+    def _refresh_daily_stats(self, days):
+        from workinfrance.dossiers.models import DailyStat
+        DailyStat.objects.db_manager(self.db).refresh_days(days)
+
+
+class PrefectureQueries(DossierQueries):
 
     def watch_before_renew(self, descending=True):
         """
@@ -20,15 +114,15 @@ class PrefectureQueries(models.QuerySet):
         from_datetime = timezone.now() - datetime.timedelta(days=62)
         return (
             self
-            .filter(champs_json__date_dexpiration_titre_sejour__gt=from_datetime.strftime('%Y-%m-%d'))
-            .annotate(expiration_admin_order=KeyTextTransform('date_dexpiration_titre_sejour', 'champs_json'))
-            .order_by(OrderBy(RawSQL('champs_json->>%s', ('date_dexpiration_titre_sejour',)), descending=descending))
+            .filter(residence_permit_expiration_date__gt=from_datetime.date())
+            .order_by(OrderBy(F('residence_permit_expiration_date'), descending=descending))
         )
 
 
-class StatsQueries(models.QuerySet):
+class StatsQueries(DossierQueries):
 
-    def get_num_by_country(self):
+    @cached_stats
+    def get_num_by_country(self, by=None):
         """
         Number of Dossiers by country.
 
@@ -38,16 +132,41 @@ class StatsQueries(models.QuerySet):
                 'MAROC': 6,
                 …
             }
+
+        With `by` (a field name, e.g. 'department'), returns a dict of such dicts for each value of `by`.
+        All the countries are included in each dict (in the same order), with 0 values if needed:
+            {
+                '75 - Paris': {'ALGERIE': 50, 'MAROC': 0, …},
+                '93 - Seine-Saint-Denis': {'ALGERIE': 13, 'MAROC': 6, …},
+                …
+            }
         """
-        return dict(
+        if by is None:
+            return dict(
+                self
+                .values('nationality')
+                .annotate(total=Count('nationality'))
+                .order_by('-total')
+                .values_list('nationality', 'total')
+            )
+        totals = {}
+        counts = {}
+        for by_value, nationality, total in (
             self
-            .annotate(nationalite=KeyTextTransform('nationalite', 'champs_json'))
-            .values('nationalite')
-            .annotate(total=Count('nationalite'))
-            .order_by('-total')
-            .values_list('nationalite', 'total')
-        )
+            .values(by, 'nationality')
+            .annotate(total=Count('nationality'))
+            .order_by(by)
+            .values_list(by, 'nationality', 'total')
+        ):
+            totals[nationality] = totals.get(nationality, 0) + total
+            counts.setdefault(by_value, {})[nationality] = total
+        countries = sorted(totals, key=totals.get, reverse=True)
+        return {
+            by_value: {country: by_value_counts.get(country, 0) for country in countries}
+            for by_value, by_value_counts in counts.items()
+        }
 
+    @cached_stats
     def get_num_by_day(self, from_datetime=None, to_datetime=None):
         """
         Number of Dossiers by day (during the last 31 days by default).
@@ -77,7 +196,8 @@ class StatsQueries(models.QuerySet):
             for date in utils.daterange(from_datetime, to_datetime)
         }
 
-    def get_num_by_month(self, from_datetime=None, to_datetime=None):
+    @cached_stats
+    def get_num_by_month(self, from_datetime=None, to_datetime=None, by=None):
         """
         Number of Dossiers by month (during the last 365 days by default).
 
@@ -87,21 +207,31 @@ class StatsQueries(models.QuerySet):
                 datetime.datetime(2018, 4, 1, 0, 0, tzinfo=<UTC>): 80,
                 …
             }
+
+        With `by` (a field name, e.g. 'department'), returns a dict of such dicts for each value of `by`.
+        All the months of the period are included in each dict, with 0 values if needed.
         """
         if not all([from_datetime, to_datetime]):
             to_datetime = timezone.now()
             from_datetime = to_datetime - datetime.timedelta(days=365)
-        return dict(
+        q = (
             self
             .filter(created_at__range=(from_datetime, to_datetime))
             .annotate(month=TruncMonth('created_at'))
-            .values('month')
-            .annotate(total=Count('month'))
-            .order_by('month')
-            .values_list('month', 'total')
         )
+        if by is None:
+            return dict(
+                q
+                .values('month')
+                .annotate(total=Count('month'))
+                .order_by('month')
+                .values_list('month', 'total')
+            )
+        months = list(utils.monthrange(from_datetime, to_datetime))
+        return self._zero_filled_counts(q.values(by, 'month'), by, 'month', months)
 
-    def get_num_by_status(self):
+    @cached_stats
+    def get_num_by_status(self, by=None):
         """
         Number of Dossiers in each status.
 
@@ -111,35 +241,77 @@ class StatsQueries(models.QuerySet):
                 'closed': 74,
                 …
             }
+
+        With `by` (a field name, e.g. 'department'), returns a dict of such dicts for each value of `by`:
+            {
+                '75 - Paris': {'initiated': 10, 'closed': 0, …},
+                '93 - Seine-Saint-Denis': {'initiated': 5, 'closed': 74, …},
+                …
+            }
         """
-        statuses_count = {
-            item['status']: item['status_count']
-            for item in self.model.objects.values('status').annotate(status_count=Count('status'))
-        }
-        # 0 values are not included in GROUP BY => build and return a custom dict.
-        for key in dict(self.model.STATUS_CHOICES):
-            if key not in statuses_count:
-                statuses_count[key] = 0
-        return statuses_count
+        statuses = list(dict(self.model.STATUS_CHOICES))
+        if by is None:
+            # 0 values are not included in GROUP BY => start from a dict of all statuses.
+            statuses_count = dict.fromkeys(statuses, 0)
+            statuses_count.update(
+                self
+                .values('status')
+                .annotate(total=Count('status'))
+                .order_by()
+                .values_list('status', 'total')
+            )
+            return statuses_count
+        return self._zero_filled_counts(self.values(by, 'status'), by, 'status', statuses)
 
+    def _zero_filled_counts(self, values_queryset, by, field, keys):
+        """
+        Count the rows of the given `values_queryset` grouped by `by` and `field`, in a single query.
+
+        Returns a dict mapping each value of `by` to a dict of the counts by `field`,
+        with all the given `keys` (0 values included).
+        """
+        counts = {}
+        for by_value, value, total in (
+            values_queryset
+            .annotate(total=Count('*'))
+            .order_by(by)
+            .values_list(by, field, 'total')
+        ):
+            if by_value not in counts:
+                counts[by_value] = dict.fromkeys(keys, 0)
+            counts[by_value][value] = total
+        return counts
+
+    @cached_stats
     def get_time_to_process(self):
         """
         Global average time to process a Dossier.
 
         Returns a datetime.timedelta object.
         """
-        q = (
-            self
-            .annotate(
-                processing_duration=ExpressionWrapper(
-                    F('updated_at') - F('created_at'), output_field=models.DurationField()
-                )
-            )
-            .values_list('processing_duration', flat=True)
+        return self.aggregate(time_to_process=Avg(PROCESSING_DURATION))['time_to_process']
+
+    @cached_stats
+    def get_time_to_process_distribution(self):
+        """
+        Global average, median and 90th/99th percentiles of the time to process a Dossier.
+
+        Returns a dict of datetime.timedelta objects:
+            {
+                'average': datetime.timedelta(4, 26541, 816444),
+                'median': datetime.timedelta(2, 5400),
+                'p90': datetime.timedelta(9, 3600),
+                'p99': datetime.timedelta(21, 600),
+            }
+        """
+        return self.aggregate(
+            average=Avg(PROCESSING_DURATION),
+            median=PercentileCont(PROCESSING_DURATION, percentile=0.5),
+            p90=PercentileCont(PROCESSING_DURATION, percentile=0.9),
+            p99=PercentileCont(PROCESSING_DURATION, percentile=0.99),
         )
-        time_to_process = sum(q, datetime.timedelta()) / len(q)
-        return time_to_process  # Return a timedelta object.
 
+    @cached_stats
     def get_time_to_process_by_month(self, from_datetime=None, to_datetime=None):
         """
         Average time to process a Dossier by month (during the last 365 days by default).
@@ -159,15 +331,288 @@ class StatsQueries(models.QuerySet):
             .filter(created_at__range=(from_datetime, to_datetime))
             .annotate(month=TruncMonth('created_at'))
             .values('month')
+            .annotate(processing_duration=Avg(PROCESSING_DURATION))
+            .order_by('month')
+            .values_list('month', 'processing_duration')
+        )
+        return dict(q)
+
+    @cached_stats
+    def get_all_stats(self):
+        """
+        Compute all the stats of the `export_stats_data` command in a single query, with the same
+        default periods as the other methods of this class.
+
+        Instead of scanning the table once per stat, rows are scanned once and aggregated
+        with `GROUPING SETS` (one grouping set per stat) and `FILTER` clauses (for closed Dossiers).
+
+        Returns a dict:
+            {
+                'num_by_day': same as get_num_by_day(),
+                'num_by_month': same as get_num_by_month(),
+                'num_by_status': same as get_num_by_status(),
+                'num_by_country': same as get_num_by_country(),
+                'time_to_process_by_month': same as filter(status=closed).get_time_to_process_by_month(),
+                'time_to_process': same as filter(status=closed).get_time_to_process(),
+                'time_to_process_median': same as filter(status=closed).get_time_to_process_distribution()['median'],
+                'time_to_process_p90': …,
+                'time_to_process_p99': …,
+                'total_dossiers': 159,
+                'total_dossiers_closed': 74,
+            }
+        """
+        to_datetime = timezone.now()
+        day_from_datetime = to_datetime - datetime.timedelta(days=31)
+        month_from_datetime = to_datetime - datetime.timedelta(days=365)
+        tzname = timezone.get_current_timezone_name()
+
+        dossiers_sql, dossiers_params = (
+            self.values('status', 'nationality', 'created_at', 'updated_at').query.sql_with_params()
+        )
+        sql = f"""
+            WITH dossiers AS ({dossiers_sql})
+            SELECT
+                GROUPING(day), GROUPING(month), GROUPING(status), GROUPING(nationality),
+                day, month, status, nationality,
+                COUNT(*),
+                COUNT(*) FILTER (WHERE status = %s),
+                AVG(processing_duration) FILTER (WHERE status = %s),
+                PERCENTILE_CONT(ARRAY[0.5, 0.9, 0.99]) WITHIN GROUP (ORDER BY processing_duration)
+                    FILTER (WHERE status = %s)
+            FROM (
+                SELECT
+                    CASE WHEN created_at BETWEEN %s AND %s
+                        THEN (created_at AT TIME ZONE %s)::date END AS day,
+                    CASE WHEN created_at BETWEEN %s AND %s
+                        THEN DATE_TRUNC('month', created_at AT TIME ZONE %s) END AS month,
+                    status,
+                    nationality,
+                    updated_at - created_at AS processing_duration
+                FROM dossiers
+            ) AS keyed_dossiers
+            GROUP BY GROUPING SETS ((day), (month), (status), (nationality), ())
+        """
+        params = dossiers_params + (
+            self.model.STATUS_CLOSED, self.model.STATUS_CLOSED, self.model.STATUS_CLOSED,
+            day_from_datetime, to_datetime, tzname,
+            month_from_datetime, to_datetime, tzname,
+        )
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        stats = {
+            'num_by_day': {date: 0 for date in utils.daterange(day_from_datetime, to_datetime)},
+            'num_by_month': {},
+            'num_by_status': dict.fromkeys(dict(self.model.STATUS_CHOICES), 0),
+            'num_by_country': {},
+            'time_to_process_by_month': {},
+            'time_to_process': None,
+            'time_to_process_median': None,
+            'time_to_process_p90': None,
+            'time_to_process_p99': None,
+            'total_dossiers': 0,
+            'total_dossiers_closed': 0,
+        }
+        tz = timezone.get_current_timezone()
+        for row in rows:
+            grouping, key = row[:4], row[4:8]
+            total, total_closed, processing_duration, processing_duration_percentiles = row[8:]
+            if grouping == (0, 1, 1, 1):
+                if key[0] is not None:
+                    stats['num_by_day'][key[0]] = total
+            elif grouping == (1, 0, 1, 1):
+                if key[1] is not None:
+                    month = timezone.make_aware(key[1], tz)
+                    stats['num_by_month'][month] = total
+                    if processing_duration is not None:
+                        stats['time_to_process_by_month'][month] = processing_duration
+            elif grouping == (1, 1, 0, 1):
+                stats['num_by_status'][key[2]] = total
+            elif grouping == (1, 1, 1, 0):
+                # Like `Count('nationality')`, don't count Dossiers without nationality.
+                stats['num_by_country'][key[3]] = total if key[3] is not None else 0
+            else:
+                stats['total_dossiers'] = total
+                stats['total_dossiers_closed'] = total_closed
+                stats['time_to_process'] = processing_duration
+                if processing_duration_percentiles:
+                    (
+                        stats['time_to_process_median'],
+                        stats['time_to_process_p90'],
+                        stats['time_to_process_p99'],
+                    ) = processing_duration_percentiles
+
+        stats['num_by_month'] = dict(sorted(stats['num_by_month'].items()))
+        stats['time_to_process_by_month'] = dict(sorted(stats['time_to_process_by_month'].items()))
+        stats['num_by_country'] = dict(
+            sorted(stats['num_by_country'].items(), key=lambda item: item[1], reverse=True)
+        )
+        return stats
+
+
+class DailyStatQueries(models.QuerySet):
+    """
+    Same stats as `StatsQueries`, read from the daily rollups (see `DailyStat`) instead of the Dossiers.
+    """
+
+    @cached_stats
+    def get_num_by_country(self):
+        """
+        Number of Dossiers by country, see `StatsQueries.get_num_by_country()`.
+        """
+        q = (
+            self
+            .values('nationality')
+            .annotate(total=Sum('total'))
+            .values_list('nationality', 'total')
+        )
+        # Like `Count('nationality')`, don't count Dossiers without nationality.
+        by_country = {nationality: total if nationality is not None else 0 for nationality, total in q}
+        return dict(sorted(by_country.items(), key=lambda item: item[1], reverse=True))
+
+    @cached_stats
+    def get_num_by_day(self, from_datetime=None, to_datetime=None):
+        """
+        Number of Dossiers by day (during the last 31 days by default), see `StatsQueries.get_num_by_day()`.
+        """
+        if not all([from_datetime, to_datetime]):
+            to_datetime = timezone.now()
+            from_datetime = to_datetime - datetime.timedelta(days=31)
+        q = dict(
+            self
+            .filter(day__range=(timezone.localtime(from_datetime).date(), timezone.localtime(to_datetime).date()))
+            .values('day')
+            .annotate(total=Sum('total'))
+            .order_by('day')
+            .values_list('day', 'total')
+        )
+        return {
+            date: q.get(date, 0)
+            for date in utils.daterange(from_datetime, to_datetime)
+        }
+
+    @cached_stats
+    def get_num_by_month(self, from_datetime=None, to_datetime=None):
+        """
+        Number of Dossiers by month (during the last 365 days by default), see `StatsQueries.get_num_by_month()`.
+        """
+        return {
+            values['month']: values['total']
+            for values in self._by_month(from_datetime=from_datetime, to_datetime=to_datetime)
+        }
+
+    @cached_stats
+    def get_num_by_status(self):
+        """
+        Number of Dossiers in each status, see `StatsQueries.get_num_by_status()`.
+        """
+        statuses_count = dict.fromkeys(dict(self.model._meta.get_field('status').choices), 0)
+        statuses_count.update(
+            self
+            .values('status')
+            .annotate(total=Sum('total'))
+            .values_list('status', 'total')
+        )
+        return statuses_count
+
+    @cached_stats
+    def get_time_to_process(self):
+        """
+        Global average time to process a Dossier.
+
+        Returns a datetime.timedelta object.
+        """
+        totals = self.aggregate(
+            processing_duration_sum=Sum('processing_duration_sum'),
+            processing_duration_count=Sum('processing_duration_count'),
+        )
+        if not totals['processing_duration_count']:
+            return None
+        return totals['processing_duration_sum'] / totals['processing_duration_count']
+
+    @cached_stats
+    def get_time_to_process_by_month(self, from_datetime=None, to_datetime=None):
+        """
+        Average time to process a Dossier by month (during the last 365 days by default),
+        see `StatsQueries.get_time_to_process_by_month()`.
+        """
+        return {
+            values['month']: values['processing_duration_sum'] / values['processing_duration_count']
+            for values in self._by_month(from_datetime=from_datetime, to_datetime=to_datetime)
+            if values['processing_duration_count']
+        }
+
+    def _by_month(self, *fields, from_datetime=None, to_datetime=None):
+        """
+        Sums by month (during the last 365 days by default) and by the given `fields`.
+        Months are aware datetimes, like the keys of `StatsQueries.get_num_by_month()`.
+        """
+        if not all([from_datetime, to_datetime]):
+            to_datetime = timezone.now()
+            from_datetime = to_datetime - datetime.timedelta(days=365)
+        q = (
+            self
+            .filter(day__range=(timezone.localtime(from_datetime).date(), timezone.localtime(to_datetime).date()))
+            .annotate(month=TruncMonth('day'))
+            .values('month', *fields)
             .annotate(
-                total_dossiers=Count('month'),
-                processing_duration=Sum(ExpressionWrapper(
-                    F('updated_at') - F('created_at'), output_field=models.DurationField()
-                )
-            ))
+                total=Sum('total'),
+                processing_duration_sum=Sum('processing_duration_sum'),
+                processing_duration_count=Sum('processing_duration_count'),
+            )
             .order_by('month')
         )
+        for values in q:
+            values['month'] = timezone.make_aware(datetime.datetime.combine(values['month'], datetime.time()))
+            yield values
+
+    @cached_stats
+    def get_all_stats(self):
+        """
+        Compute all the stats of the `export_stats_data` command, see `StatsQueries.get_all_stats()`.
+
+        Stats by status and by month are grouped by status too, so that stats of closed Dossiers
+        don't need extra queries. Percentiles of the time to process can't be computed from the rollups:
+        they are computed from the closed Dossiers.
+        """
+        from workinfrance.dossiers.models import Dossier
+
+        by_status = {
+            values.pop('status'): values
+            for values in self.values('status').annotate(
+                total=Sum('total'),
+                processing_duration_sum=Sum('processing_duration_sum'),
+                processing_duration_count=Sum('processing_duration_count'),
+            )
+        }
+        num_by_status = dict.fromkeys(dict(Dossier.STATUS_CHOICES), 0)
+        num_by_status.update({status: values['total'] for status, values in by_status.items()})
+        closed = by_status.get(Dossier.STATUS_CLOSED, {})
+
+        num_by_month = {}
+        time_to_process_by_month = {}
+        for values in self._by_month('status'):
+            num_by_month[values['month']] = num_by_month.get(values['month'], 0) + values['total']
+            if values['status'] == Dossier.STATUS_CLOSED and values['processing_duration_count']:
+                time_to_process_by_month[values['month']] = (
+                    values['processing_duration_sum'] / values['processing_duration_count']
+                )
+
+        distribution = Dossier.stats_objects.filter(status=Dossier.STATUS_CLOSED).get_time_to_process_distribution()
         return {
-            item['month']: item['processing_duration'] / item['total_dossiers']
-            for item in q
+            'num_by_day': self.get_num_by_day(),
+            'num_by_month': num_by_month,
+            'num_by_status': num_by_status,
+            'num_by_country': self.get_num_by_country(),
+            'time_to_process_by_month': time_to_process_by_month,
+            'time_to_process': (
+                closed['processing_duration_sum'] / closed['processing_duration_count']
+                if closed.get('processing_duration_count') else None
+            ),
+            'time_to_process_median': distribution['median'],
+            'time_to_process_p90': distribution['p90'],
+            'time_to_process_p99': distribution['p99'],
+            'total_dossiers': sum(num_by_status.values()),
+            'total_dossiers_closed': num_by_status[Dossier.STATUS_CLOSED],
         }
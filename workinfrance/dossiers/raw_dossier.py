@@ -6,6 +6,8 @@ GET /api/v1/procedures/:procedure_id/dossiers/:id
 https://www.demarches-simplifiees.fr/docs/1.0/dossiers/show.fr.html
 
 Personal data has been anonymized.
+
+Used by the tests, and as the template of the dossiers generated by `ds_api_simulator`.
 """
 
 # Yes, lines are long.
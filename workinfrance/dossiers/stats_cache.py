@@ -0,0 +1,88 @@
+"""
+Cache of the results of stats queries.
+
+Results are cached in the `stats` cache, keyed by the DB name, the SQL of the queryset, the method, its arguments,
+the current day (default periods are relative to today) and a data version.
+The data version is a random token replaced each time Dossiers or stats rollups are written,
+which invalidates all cached results at once without touching the DB.
+There is a data version by DB name: the cache may be shared by several DBs (e.g. the test DB of `benchmark_sync`).
+"""
+import functools
+import hashlib
+import uuid
+
+from django.core.cache import caches
+from django.core.exceptions import EmptyResultSet
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+
+DATA_VERSION_KEY = 'data_version'
+
+# Distinguish a missing key from a cached `None` result.
+MISSING = object()
+
+
+def get_cache():
+    return caches['stats']
+
+
+def get_db_name(using=None):
+    return connections[using or DEFAULT_DB_ALIAS].settings_dict['NAME']
+
+
+def get_data_version(using=None):
+    """
+    Return the current data version of the given DB, creating one if needed (e.g. the cache has been cleared).
+    """
+    cache = get_cache()
+    key = _data_version_key(using)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key)
+    return version
+
+
+def bump_data_version(using=None):
+    """
+    Invalidate all the cached stats of the given DB.
+
+    Stats cached by other processes between now and the end of the current transaction would be computed
+    from the data before the transaction: they are invalidated again after the commit.
+    """
+    _set_new_data_version(using)
+    transaction.on_commit(functools.partial(_set_new_data_version, using), using=using)
+
+
+def _data_version_key(using):
+    return f'{DATA_VERSION_KEY}:{get_db_name(using)}'
+
+
+def _set_new_data_version(using):
+    get_cache().set(_data_version_key(using), uuid.uuid4().hex, timeout=None)
+
+
+def cached_stats(method):
+    """
+    Decorator caching the result of a stats method of a QuerySet.
+    """
+    @functools.wraps(method)
+    def wrapper(queryset, *args, **kwargs):
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return method(queryset, *args, **kwargs)
+        key_parts = (
+            get_db_name(queryset.db), queryset.model._meta.label, method.__name__, sql, params, args,
+            sorted(kwargs.items()), timezone.localdate(), get_data_version(queryset.db),
+        )
+        key = 'stats:' + hashlib.sha1(repr(key_parts).encode()).hexdigest()
+        cache = get_cache()
+        result = cache.get(key, MISSING)
+        if result is MISSING:
+            result = method(queryset, *args, **kwargs)
+            cache.set(key, result)
+        return result
+    return wrapper
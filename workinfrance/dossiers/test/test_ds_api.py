@@ -0,0 +1,36 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+import requests
+
+from workinfrance.dossiers.ds_api import DemarchesSimplifieesClient
+
+
+class DemarchesSimplifieesClientTest(SimpleTestCase):
+
+    def test_session(self):
+        client = DemarchesSimplifieesClient(
+            base_url='https://ds.test/api/v1', procedure_id=3272, token='secret',
+            pool_size=8, max_retries=3, backoff_factor=0.1,
+        )
+        self.assertIs(client.session.get_adapter('https://ds.test/api/v1'), client.adapter)
+        self.assertEqual(client.adapter._pool_maxsize, 8)
+        self.assertEqual(client.adapter.max_retries.total, 3)
+        self.assertEqual(client.adapter.max_retries.backoff_factor, 0.1)
+        self.assertIn(429, client.adapter.max_retries.status_forcelist)
+        self.assertTrue(client.adapter.max_retries.respect_retry_after_header)
+        self.assertEqual(client.session.params, {'token': 'secret'})
+
+    def test_get_dossier(self):
+        client = DemarchesSimplifieesClient(base_url='https://ds.test/api/v1', procedure_id=3272, timeout=5)
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {'dossier': {'id': 44950}}
+        with mock.patch.object(client.session, 'get', return_value=response) as mock_get:
+            self.assertEqual(client.get_dossier(44950), {'dossier': {'id': 44950}})
+        mock_get.assert_called_once_with('https://ds.test/api/v1/procedures/3272/dossiers/44950', timeout=5)
+
+        response.raise_for_status.side_effect = requests.HTTPError('404 Client Error')
+        with mock.patch.object(client.session, 'get', return_value=response):
+            with self.assertRaises(requests.HTTPError):
+                client.get_dossier(1)
@@ -0,0 +1,48 @@
+from django.test import SimpleTestCase
+
+import requests
+
+from workinfrance.dossiers.ds_api import DemarchesSimplifieesClient
+from workinfrance.dossiers.ds_api_simulator import DemarchesSimplifieesSimulator, generate_raw_dossier
+from workinfrance.dossiers.models import Dossier
+from workinfrance.dossiers.raw_dossier import RAW_DOSSIER
+
+
+class DemarchesSimplifieesSimulatorTest(SimpleTestCase):
+
+    def test_generate_raw_dossier(self):
+        raw_json = generate_raw_dossier(100001)
+        self.assertEqual(raw_json, generate_raw_dossier(100001))
+        self.assertNotEqual(raw_json, generate_raw_dossier(100001, seed=1))
+        self.assertEqual(raw_json['dossier']['id'], 100001)
+        self.assertEqual(raw_json['dossier'].keys(), RAW_DOSSIER['dossier'].keys())
+        self.assertIn(raw_json['dossier']['state'], dict(Dossier.STATUS_CHOICES))
+        champs_json = Dossier.reformat_json_champs(raw_json)
+        apt_start_date = Dossier.derive_fields(raw_json)['apt_start_date']
+        self.assertEqual(apt_start_date.isoformat(), champs_json['date_de_debut_apt'])
+
+    def test_client(self):
+        with DemarchesSimplifieesSimulator(dossiers_count=5, per_page=2) as simulator:
+            client = DemarchesSimplifieesClient(base_url=simulator.base_url, procedure_id=1, token='t')
+            page = client.get_dossiers_page(3)
+            self.assertEqual([item['id'] for item in page['dossiers']], [100004])
+            self.assertEqual(page['pagination']['nombre_de_page'], 3)
+
+            dossier = client.get_dossier(100004)
+            self.assertEqual(dossier, generate_raw_dossier(100004))
+            self.assertEqual(dossier['dossier']['updated_at'], page['dossiers'][0]['updated_at'])
+
+            with self.assertRaises(requests.HTTPError):
+                client.get_dossier(100005)
+            self.assertEqual(simulator.count_requests, 3)
+            client.close()
+
+    def test_errors(self):
+        with DemarchesSimplifieesSimulator(dossiers_count=1, error_rate=1) as simulator:
+            client = DemarchesSimplifieesClient(
+                base_url=simulator.base_url, procedure_id=1, token='t', max_retries=2, backoff_factor=0,
+            )
+            with self.assertRaises(requests.exceptions.RetryError):
+                client.get_dossier(100000)
+            self.assertEqual(simulator.count_errors, 3)
+            client.close()
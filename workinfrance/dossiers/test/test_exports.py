@@ -0,0 +1,59 @@
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from workinfrance.dossiers import exports
+
+
+class ExportsTest(SimpleTestCase):
+
+    def test_write_json_array(self):
+        outfile = io.StringIO()
+        items = ({'id': i, 'date': datetime.date(2018, 3, 27)} for i in range(3))
+        self.assertEqual(exports.write_json_array(outfile, items), 3)
+        self.assertEqual(json.loads(outfile.getvalue()), [{'id': i, 'date': '2018-03-27'} for i in range(3)])
+
+        outfile = io.StringIO()
+        self.assertEqual(exports.write_json_array(outfile, []), 0)
+        self.assertEqual(outfile.getvalue(), '[]')
+
+    def test_atomic_write(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'export.json')
+            with exports.atomic_write(file_path) as outfile:
+                outfile.write('[1]')
+            with open(file_path) as f:
+                self.assertEqual(f.read(), '[1]')
+
+            # The previous file is kept when writing fails.
+            with self.assertRaises(ValueError):
+                with exports.atomic_write(file_path) as outfile:
+                    outfile.write('[2')
+                    raise ValueError()
+            with open(file_path) as f:
+                self.assertEqual(f.read(), '[1]')
+            self.assertEqual(os.listdir(tmp_dir), ['export.json'])
+
+    def test_atomic_write_compress(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'export.json.gz')
+            with exports.atomic_write(file_path, compress=True) as outfile:
+                outfile.write('["é"]')
+            with gzip.open(file_path, 'rt', encoding='utf-8') as f:
+                self.assertEqual(json.load(f), ['é'])
+
+    def test_to_columns(self):
+        items = [
+            {'id': 1, 'date': datetime.date(1970, 1, 11), 'flag': True},
+            {'id': 2, 'date': None, 'flag': False},
+        ]
+        self.assertEqual(exports.to_columns(iter(items)), {
+            'epoch': datetime.date(1970, 1, 1),
+            'count': 2,
+            'columns': {'id': [1, 2], 'date': [10, None], 'flag': [True, False]},
+        })
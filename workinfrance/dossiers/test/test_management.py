@@ -1,18 +1,72 @@
+import copy
+import datetime
+import gzip
 import io
+import json
+import os
+import random
+import re
+import tempfile
+import time
 
 from unittest import mock
 
+from django.conf import settings
 from django.core.management import call_command
-from django.test import TestCase
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
 
-from workinfrance.dossiers.models import Dossier
+import requests
+
+from workinfrance.dossiers import stats_cache
+from workinfrance.dossiers import utils
+from workinfrance.dossiers.management.commands.export_validity_check_data import (
+    Command as ExportValidityCheckDataCommand,
+)
+from workinfrance.dossiers.models import DailyStat, Dossier, Synchronization
+from workinfrance.dossiers.raw_dossier import RAW_DOSSIER
 from workinfrance.dossiers.test.raw_dossiers_fixture import RAW_DOSSIERS
-from workinfrance.dossiers.test.raw_dossier_fixture import RAW_DOSSIER
+
+
+def raw_dossier(ds_id):
+    """
+    Return a copy of `RAW_DOSSIER` with the given `ds_id`.
+    """
+    raw_json = copy.deepcopy(RAW_DOSSIER)
+    raw_json['dossier']['id'] = ds_id
+    return raw_json
+
+
+def create_dossier(ds_id, **fields):
+    """
+    Create a Dossier from `raw_dossier(ds_id)`. `fields` override the values read from `RAW_DOSSIER`.
+    """
+    raw_json = raw_dossier(ds_id)
+    values = {
+        'ds_id': ds_id,
+        'status': raw_json['dossier']['state'],
+        'created_at': utils.json_datetime_to_python(raw_json['dossier']['created_at']),
+        'updated_at': utils.json_datetime_to_python(raw_json['dossier']['updated_at']),
+        'department': '75 - Paris',
+        'raw_json': raw_json,
+    }
+    values.update(fields)
+    return Dossier.objects.create(**values)
+
+
+def read_media_json(file_name):
+    """
+    Return the content of the given JSON file of the media root, gzipped if its name ends with `.gz`.
+    """
+    opener = gzip.open if file_name.endswith('.gz') else open
+    with opener(os.path.join(settings.MEDIA_ROOT, file_name), 'rt', encoding='utf-8') as f:
+        return json.load(f)
 
 
 def mocked_requests_get(*args, **kwargs):
     """
-    Simple method to mock Requests.get and the response.
+    Simple method to mock Requests.Session.get and the response.
     """
 
     class MockResponse:
@@ -24,6 +78,10 @@ def mocked_requests_get(*args, **kwargs):
         def json(self):
             return self.json_data
 
+        def raise_for_status(self):
+            if self.status_code >= 400:
+                raise requests.HTTPError(f'{self.status_code} Error')
+
     endpoint = args[0]
 
     if endpoint == 'https://www.demarches-simplifiees.fr/api/v1/procedures/3272/dossiers':
@@ -35,9 +93,36 @@ def mocked_requests_get(*args, **kwargs):
     return MockResponse(None, 404)
 
 
+def mocked_requests_get_many(*args, **kwargs):
+    """
+    Mock Requests.Session.get for a procedure containing several dossiers listed in 2 pages,
+    answering with a random latency.
+    """
+    response = mocked_requests_get(*args, **kwargs)
+    endpoint = args[0]
+    dossiers_ids = [44950 + i for i in range(10)]
+
+    if endpoint == 'https://www.demarches-simplifiees.fr/api/v1/procedures/3272/dossiers':
+        page = json.loads(kwargs['data'])['page']
+        response.json_data = copy.deepcopy(RAW_DOSSIERS)
+        response.json_data['dossiers'] = [
+            {'id': dossier_id, 'updated_at': RAW_DOSSIER['dossier']['updated_at']}
+            for dossier_id in dossiers_ids[(page - 1) * 5:page * 5]
+        ]
+        response.json_data['pagination'].update({'page': page, 'resultats_par_page': 5, 'nombre_de_page': 2})
+
+    prefix = 'https://www.demarches-simplifiees.fr/api/v1/procedures/3272/dossiers/'
+    if endpoint.startswith(prefix) and int(endpoint[len(prefix):]) in dossiers_ids:
+        time.sleep(random.random() / 100)
+        response.json_data = raw_dossier(int(endpoint[len(prefix):]))
+        response.status_code = 200
+
+    return response
+
+
 class ManagementCommandTest(TestCase):
 
-    @mock.patch('requests.get', side_effect=mocked_requests_get)
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get)
     def testSyncDossiersCommand(self, mock_get):
         """
         Test the django-admin command `sync_dossiers`.
@@ -51,12 +136,425 @@ Fetching dossier 44950
 Storing dossier 44950
 --------------------------------------------------------------------------------
 1 - number of dossiers checked
+0 - number of dossiers unchanged since the last synchronization
+0 - number of dossiers fetched but not written because unchanged
 2 - number of HTTP queries performed
 1 - number of dossiers processed
+X - number of dossiers written per second
 Done."""
 
-        self.assertEqual(out.getvalue().strip(), expected_result)
+        # The write rate depends on the machine.
+        output = re.sub(r'^[0-9.]+ - number of dossiers written', 'X - number of dossiers written',
+            out.getvalue().strip(), flags=re.MULTILINE)
+        self.assertEqual(output, expected_result)
 
         dossier = Dossier.objects.get(ds_id='44950')
         self.assertEqual(dossier.status, Dossier.STATUS_CLOSED)
         self.assertEqual(dossier.nom_de_lemployeur, 'Morane')
+
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get_many)
+    def testSyncDossiersCommandWithWorkers(self, mock_get):
+        """
+        Test the django-admin command `sync_dossiers` with concurrent fetching.
+        """
+        out = io.StringIO()
+        call_command('sync_dossiers', '--workers', '4', '--batch-size', '3', stdout=out)
+
+        stored = [line for line in out.getvalue().splitlines() if line.startswith('Storing dossier')]
+        # Dossiers are stored in the order of the listing.
+        self.assertEqual(stored, [f'Storing dossier {44950 + i}' for i in range(10)])
+        self.assertIn('12 - number of HTTP queries performed', out.getvalue())
+        self.assertIn('10 - number of dossiers processed', out.getvalue())
+        self.assertEqual(Dossier.objects.count(), 10)
+        # Daily stats are maintained by the synchronization.
+        self.assertEqual(DailyStat.objects.get_num_by_status(), Dossier.stats_objects.get_num_by_status())
+        self.assertEqual(sum(DailyStat.objects.get_num_by_status().values()), 10)
+
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get_many)
+    def testSyncDossiersCommandIncremental(self, mock_get):
+        """
+        Test that `sync_dossiers` only checks dossiers that changed since the last synchronization.
+        """
+        call_command('sync_dossiers', stdout=io.StringIO())
+        sync = Synchronization.objects.last_successful()
+        self.assertTrue(sync.full)
+        self.assertEqual(sync.high_water_mark.isoformat(), '2018-03-27T09:15:10.780000+00:00')
+
+        out = io.StringIO()
+        call_command('sync_dossiers', stdout=out)
+        self.assertIn('10 - number of dossiers unchanged since the last synchronization', out.getvalue())
+        self.assertIn('2 - number of HTTP queries performed', out.getvalue())
+        self.assertFalse(Synchronization.objects.last_successful().full)
+
+        out = io.StringIO()
+        # Completed dossiers are found with a single preload query per page, not one query per dossier.
+        # The 4 other queries create, checkpoint (after each page) and end the Synchronization.
+        with self.assertNumQueries(6):
+            call_command('sync_dossiers', '--full', stdout=out)
+        self.assertIn('0 - number of dossiers unchanged since the last synchronization', out.getvalue())
+        self.assertEqual(out.getvalue().count('already in a completed state'), 10)
+
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get_many)
+    def testSyncDossiersCommandIncrementalOlderChange(self, mock_get):
+        """
+        Test that `sync_dossiers` fetches a changed dossier even if it's older than the high water mark.
+        """
+        call_command('sync_dossiers', stdout=io.StringIO())
+        # The dossier changed while a previous synchronization was listing later pages.
+        Synchronization.objects.update(high_water_mark=timezone.now())
+        Dossier.objects.filter(ds_id=44951).update(
+            status=Dossier.STATUS_INITIATED, updated_at=datetime.datetime(2018, 1, 1, tzinfo=timezone.utc),
+            payload_hash='old')
+
+        out = io.StringIO()
+        call_command('sync_dossiers', stdout=out)
+        self.assertIn('9 - number of dossiers unchanged since the last synchronization', out.getvalue())
+        self.assertIn('Storing dossier 44951', out.getvalue())
+        self.assertEqual(Dossier.objects.get(ds_id=44951).status, Dossier.STATUS_CLOSED)
+
+    @mock.patch('requests.Session.get', side_effect=mocked_requests_get_many)
+    def testSyncDossiersCommandUnchangedPayload(self, mock_get):
+        """
+        Test that `sync_dossiers` doesn't write dossiers whose raw JSON is unchanged.
+        """
+        call_command('sync_dossiers', stdout=io.StringIO())
+        # Dossiers in a completed state are not fetched again.
+        Dossier.objects.update(status=Dossier.STATUS_INITIATED)
+        Dossier.objects.filter(ds_id=44951).update(payload_hash='changed')
+
+        out = io.StringIO()
+        call_command('sync_dossiers', '--full', stdout=out)
+        self.assertIn('9 - number of dossiers fetched but not written because unchanged', out.getvalue())
+        self.assertIn('1 - number of dossiers processed', out.getvalue())
+        self.assertIn('Storing dossier 44951', out.getvalue())
+        dossier = Dossier.objects.get(ds_id=44951)
+        self.assertEqual(dossier.payload_hash, utils.json_hash(dossier.raw_json))
+
+    def testSyncDossiersCommandResume(self):
+        """
+        Test that `sync_dossiers --resume` restarts an interrupted synchronization after its last checkpoint.
+        """
+        def mocked_requests_get_failing(*args, **kwargs):
+            if args[0].endswith('/dossiers/44957'):
+                raise requests.ConnectionError()
+            return mocked_requests_get_many(*args, **kwargs)
+
+        with mock.patch('requests.Session.get', side_effect=mocked_requests_get_failing):
+            with self.assertRaises(requests.ConnectionError):
+                call_command('sync_dossiers', '--batch-size', '2', stdout=io.StringIO())
+        sync = Synchronization.objects.last_interrupted()
+        self.assertEqual(sync.last_page, 1)
+        # The 5 dossiers of page 1 and the first batch of page 2 have been stored.
+        self.assertEqual(Dossier.objects.count(), 7)
+
+        out = io.StringIO()
+        with mock.patch('requests.Session.get', side_effect=mocked_requests_get_many):
+            call_command('sync_dossiers', '--resume', stdout=out)
+        self.assertNotIn('Dossier 44950', out.getvalue())
+        self.assertIn('Fetching dossier 44957', out.getvalue())
+        self.assertIn('3 - number of dossiers processed', out.getvalue())
+        self.assertEqual(Dossier.objects.count(), 10)
+        self.assertEqual(Synchronization.objects.last_successful(), sync)
+        self.assertIsNone(Synchronization.objects.last_interrupted())
+
+
+class BenchmarkCommandsTest(TestCase):
+
+    def testBenchmarkExportUtilsCommand(self):
+        """
+        Test the django-admin command `benchmark_export_utils`.
+        """
+        out = io.StringIO()
+        call_command('benchmark_export_utils', '--count', '100', '--repeat', '1', stdout=out)
+        self.assertIn('parse dates: ', out.getvalue())
+        self.assertIn('Done.', out.getvalue())
+
+    def testGenerateDossiersCommand(self):
+        """
+        Test the django-admin command `generate_dossiers`.
+        """
+        create_dossier(41)
+        out = io.StringIO()
+        call_command('generate_dossiers', '5', '--batch-size', '2', stdout=out)
+        self.assertIn('5 dossiers generated', out.getvalue())
+
+        dossiers = Dossier.objects.filter(ds_id__gt=41).order_by('ds_id')
+        self.assertEqual([dossier.ds_id for dossier in dossiers], [42, 43, 44, 45, 46])
+        for dossier in dossiers:
+            # Rows are loaded as if they were saved from their `raw_json`.
+            self.assertEqual(dossier.raw_json['dossier']['id'], dossier.ds_id)
+            self.assertEqual(dossier.champs_json, Dossier.reformat_json_champs(dossier.raw_json))
+            self.assertEqual(dossier.payload_hash, utils.json_hash(dossier.raw_json))
+            self.assertEqual(dossier.status, dossier.raw_json['dossier']['state'])
+            self.assertEqual(
+                dossier.created_at, utils.json_datetime_to_python(dossier.raw_json['dossier']['created_at']))
+            self.assertEqual(dossier.nationality, dossier.champs_json['nationalite'])
+            self.assertEqual(
+                dossier.apt_end_date, utils.json_date_to_python_or_none(dossier.champs_json['date_de_fin_apt']))
+        # Stats rollups are refreshed.
+        self.assertEqual(sum(DailyStat.objects.values_list('total', flat=True)), 6)
+
+
+class BenchmarkSyncCommandTest(TransactionTestCase):
+
+    def testBenchmarkSyncCommand(self):
+        """
+        Test the django-admin command `benchmark_sync`.
+        """
+        out = io.StringIO()
+        call_command(
+            'benchmark_sync', '--dossiers', '12', '--pages', '2', '--latency', '0', '--noinput', stdout=out)
+        self.assertIn('12 - number of dossiers synchronized', out.getvalue())
+        # 2 pages and 12 dossiers.
+        self.assertIn('14 - number of HTTP queries received by the simulator', out.getvalue())
+        # Dossiers are stored in the temporary DB.
+        self.assertEqual(Dossier.objects.count(), 0)
+
+
+class DumpImportCommandsTest(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+
+    def write_jsonl(self, file_name, raw_jsons):
+        file_path = os.path.join(self.tmp_dir, file_name)
+        with open(file_path, 'w') as outfile:
+            for raw_json in raw_jsons:
+                outfile.write(json.dumps(raw_json) + '\n')
+        return file_path
+
+    def testImportDossiersCommand(self):
+        """
+        Test the django-admin command `import_dossiers`.
+        """
+        raw_jsons = [raw_dossier(ds_id) for ds_id in range(10, 13)]
+        file_path = self.write_jsonl('dossiers.jsonl', raw_jsons)
+        # Blank lines are ignored.
+        with open(file_path, 'a') as outfile:
+            outfile.write('\n')
+
+        out = io.StringIO()
+        call_command('import_dossiers', file_path, '--batch-size', '2', stdout=out)
+        self.assertIn('3 - number of dossiers written', out.getvalue())
+        self.assertEqual(Dossier.objects.count(), 3)
+        dossier = Dossier.objects.get(ds_id=11)
+        self.assertEqual(dossier.raw_json, raw_jsons[1])
+        self.assertEqual(dossier.champs_json, Dossier.reformat_json_champs(raw_jsons[1]))
+        self.assertEqual(dossier.department, dossier.champs_json['departement_titre_de_sejour'])
+        self.assertEqual(dossier.apt_end_date, datetime.date(2018, 5, 10))
+        self.assertEqual(sum(DailyStat.objects.values_list('total', flat=True)), 3)
+
+        # Only changed dossiers are updated, and not by older ones.
+        raw_jsons[0]['dossier']['state'] = Dossier.STATUS_REFUSED
+        raw_jsons[0]['dossier']['updated_at'] = '2018-01-01T10:00:00.000Z'
+        raw_jsons[1]['dossier']['state'] = Dossier.STATUS_REFUSED
+        raw_jsons[1]['dossier']['updated_at'] = '2018-06-01T10:00:00.000Z'
+        file_path = self.write_jsonl('dossiers.jsonl', raw_jsons)
+        out = io.StringIO()
+        call_command('import_dossiers', file_path, stdout=out)
+        self.assertIn('1 - number of dossiers written', out.getvalue())
+        self.assertEqual(Dossier.objects.get(ds_id=10).status, RAW_DOSSIER['dossier']['state'])
+        self.assertEqual(Dossier.objects.get(ds_id=11).status, Dossier.STATUS_REFUSED)
+
+        file_path = self.write_jsonl('invalid.jsonl', raw_jsons[:1])
+        with open(file_path, 'a') as outfile:
+            outfile.write('{"dossier": \n')
+        with self.assertRaisesRegex(CommandError, 'line 2'):
+            call_command('import_dossiers', file_path, stdout=io.StringIO())
+
+    def testDumpDossiersCommand(self):
+        """
+        Test the django-admin commands `dump_dossiers` and `import_dossiers` with a gzipped file.
+        """
+        for ds_id in (21, 20):
+            create_dossier(ds_id)
+        file_path = os.path.join(self.tmp_dir, 'dossiers.jsonl.gz')
+        out = io.StringIO()
+        call_command('dump_dossiers', file_path, stdout=out)
+        self.assertIn('2 dossiers dumped', out.getvalue())
+        with gzip.open(file_path, 'rt', encoding='utf-8') as infile:
+            lines = [json.loads(line) for line in infile]
+        self.assertEqual([raw_json['dossier']['id'] for raw_json in lines], [20, 21])
+
+        Dossier.objects.all().delete()
+        call_command('import_dossiers', file_path, stdout=io.StringIO())
+        self.assertEqual(
+            list(Dossier.objects.order_by('ds_id').values_list('payload__raw_json', flat=True)), lines)
+
+
+class ExportCommandsTest(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dossier = create_dossier(RAW_DOSSIER['dossier']['id'])
+        DailyStat.objects.rebuild()
+        stats_cache.get_cache().clear()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def testExportValidityCheckDataCommand(self):
+        """
+        Test the django-admin command `export_validity_check_data`.
+        """
+        out = io.StringIO()
+        call_command('export_validity_check_data', stdout=out)
+        self.assertIn('1 dossiers exported.', out.getvalue())
+
+        data = read_media_json('validity_check.json')
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['ds_id'], 44950)
+        self.assertEqual(data[0]['date_de_naissance'], '1978-12-20')
+        self.assertEqual(
+            sorted(os.listdir(self.media_root)),
+            ['validity_check.hashes.1.jsonl', 'validity_check.json', 'validity_check.manifest.json'],
+        )
+
+    def testExportValidityCheckDataCommandDelta(self):
+        """
+        Test the django-admin command `export_validity_check_data --delta`.
+        """
+        # Without a previous export, all dossiers are exported.
+        call_command('export_validity_check_data', '--delta', stdout=io.StringIO())
+        manifest = read_media_json('validity_check.manifest.json')
+        self.assertEqual(manifest['version'], 1)
+        self.assertEqual(manifest['full'], {'version': 1, 'file': 'validity_check.json', 'format': 'json'})
+
+        # Nothing changed: no delta.
+        out = io.StringIO()
+        call_command('export_validity_check_data', '--delta', stdout=out)
+        self.assertIn('0 dossiers exported, 0 dossiers removed.', out.getvalue())
+        self.assertEqual(read_media_json('validity_check.manifest.json')['version'], 1)
+
+        create_dossier(44951)
+        call_command('export_validity_check_data', '--delta', stdout=io.StringIO())
+        self.dossier.delete()
+        call_command('export_validity_check_data', '--delta', stdout=io.StringIO())
+
+        manifest = read_media_json('validity_check.manifest.json')
+        self.assertEqual(manifest['version'], 3)
+        self.assertEqual(manifest['deltas'], [
+            {'from_version': 1, 'version': 2, 'file': 'validity_check.delta.2.json'},
+            {'from_version': 2, 'version': 3, 'file': 'validity_check.delta.3.json'},
+        ])
+        delta = read_media_json('validity_check.delta.2.json')
+        self.assertEqual([item['ds_id'] for item in delta['upserts']], [44951])
+        self.assertEqual(delta['deletes'], [])
+        self.assertEqual(read_media_json('validity_check.delta.3.json'), {
+            'from_version': 2, 'version': 3, 'upserts': [], 'deletes': [44950],
+        })
+        # The full file is not rewritten.
+        self.assertEqual([item['ds_id'] for item in read_media_json('validity_check.json')], [44950])
+
+        # Dossiers are merged with the previous hashes by ds_id.
+        for ds_id in [44940, 44960]:
+            create_dossier(ds_id)
+        call_command('export_validity_check_data', '--delta', stdout=io.StringIO())
+        delta = read_media_json('validity_check.delta.4.json')
+        self.assertEqual([item['ds_id'] for item in delta['upserts']], [44940, 44960])
+        self.assertEqual(delta['deletes'], [])
+        Dossier.objects.filter(ds_id__in=[44951, 44960]).update(status=Dossier.STATUS_REFUSED)
+        call_command('export_validity_check_data', '--delta', stdout=io.StringIO())
+        delta = read_media_json('validity_check.delta.5.json')
+        self.assertEqual(delta['upserts'], [])
+        self.assertEqual(delta['deletes'], [44951, 44960])
+        manifest = read_media_json('validity_check.manifest.json')
+        self.assertEqual(manifest['hashes'], 'validity_check.hashes.5.jsonl')
+        with open(os.path.join(self.media_root, manifest['hashes'])) as f:
+            self.assertEqual([json.loads(line)[0] for line in f], [44940])
+        # Previous hashes are removed once the manifest no longer references them.
+        self.assertEqual([name for name in os.listdir(self.media_root) if '.hashes.' in name], [manifest['hashes']])
+
+        # If the manifest can't be written, the next delta is still computed from the published export.
+        Dossier.objects.filter(ds_id=44960).update(status=Dossier.STATUS_CLOSED)
+        with mock.patch.object(ExportValidityCheckDataCommand, 'write_manifest', side_effect=OSError):
+            with self.assertRaises(OSError):
+                call_command('export_validity_check_data', '--delta', stdout=io.StringIO())
+        call_command('export_validity_check_data', '--delta', stdout=io.StringIO())
+        self.assertEqual([item['ds_id'] for item in read_media_json('validity_check.delta.6.json')['upserts']], [44960])
+        Dossier.objects.filter(ds_id=44960).update(status=Dossier.STATUS_REFUSED)
+
+        # A full export drops the deltas.
+        call_command('export_validity_check_data', stdout=io.StringIO())
+        manifest = read_media_json('validity_check.manifest.json')
+        self.assertEqual(manifest['full'], {'version': 7, 'file': 'validity_check.json', 'format': 'json'})
+        self.assertEqual(manifest['deltas'], [])
+        self.assertNotIn('validity_check.delta.2.json', os.listdir(self.media_root))
+        self.assertEqual([item['ds_id'] for item in read_media_json('validity_check.json')], [44940])
+
+    def testExportValidityCheckDataCommandShards(self):
+        """
+        Test the django-admin command `export_validity_check_data --shards`.
+        """
+        for ds_id in [44951, 44952, 44955]:
+            create_dossier(ds_id)
+
+        call_command('export_validity_check_data', '--shards', '5', stdout=io.StringIO())
+        index = read_media_json('validity_check.index.json')
+        self.assertEqual(index['shards'], 5)
+        self.assertEqual(index['counts'], [2, 1, 1, 0, 0])
+        self.assertEqual([item['ds_id'] for item in read_media_json(index['files'][0])], [44950, 44955])
+        self.assertEqual(read_media_json(index['files'][4]), [])
+        self.assertEqual(len(read_media_json('validity_check.json')), 4)
+        self.assertEqual(read_media_json('validity_check.manifest.json')['full']['index'], 'validity_check.index.json')
+
+        # Shards of the previous export are removed.
+        call_command('export_validity_check_data', '--shards', '2', stdout=io.StringIO())
+        self.assertEqual(read_media_json('validity_check.index.json')['counts'], [2, 2])
+        self.assertNotIn('validity_check.shard.4.json', os.listdir(self.media_root))
+        call_command('export_validity_check_data', stdout=io.StringIO())
+        self.assertNotIn('validity_check.index.json', os.listdir(self.media_root))
+
+        with self.assertRaises(CommandError):
+            call_command('export_validity_check_data', '--delta', '--shards', '2', stdout=io.StringIO())
+
+    def testExportValidityCheckDataCommandFormats(self):
+        """
+        Test the django-admin command `export_validity_check_data --format`.
+        """
+        call_command('export_validity_check_data', '--format', 'json.gz', stdout=io.StringIO())
+        data = read_media_json('validity_check.json.gz')
+        self.assertEqual([item['ds_id'] for item in data], [44950])
+
+        call_command('export_validity_check_data', '--format', 'columnar.gz', stdout=io.StringIO())
+        data = read_media_json('validity_check.columnar.json.gz')
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['columns']['ds_id'], [44950])
+        self.assertEqual(data['columns']['prenom'], ['*o**'])
+        # Dates are encoded as a number of days since the epoch.
+        self.assertEqual(data['epoch'], '1970-01-01')
+        birth_date = datetime.date(1978, 12, 20)
+        self.assertEqual(data['columns']['date_de_naissance'], [(birth_date - datetime.date(1970, 1, 1)).days])
+        # Files of the previous export are removed.
+        self.assertNotIn('validity_check.json.gz', os.listdir(self.media_root))
+
+        with self.assertRaises(CommandError):
+            call_command('export_validity_check_data', '--format', 'columnar', '--delta', stdout=io.StringIO())
+
+    def testExportStatsDataCommand(self):
+        """
+        Test the django-admin command `export_stats_data`.
+        """
+        # Stats are read from the daily rollups, except the percentiles of the time to process.
+        with self.assertNumQueries(5):
+            call_command('export_stats_data', stdout=io.StringIO())
+        # Nothing changed since the last export: stats are read from the cache.
+        with self.assertNumQueries(0):
+            call_command('export_stats_data', stdout=io.StringIO())
+
+        data = read_media_json('stats.json')
+        self.assertEqual(data['data']['total_dossiers'], 1)
+        self.assertEqual(data['data']['total_dossiers_closed'], 1)
+        self.assertEqual(data['data']['time_to_process'], 0)
+        self.assertEqual(data['data']['time_to_process_p99'], 0)
+        self.assertEqual(data['data_num_by_contry']['labels'], ['France'])
+        self.assertEqual(data['data_num_by_status']['datasets'][0]['values'], [0, 0, 0, 1, 0, 0])
+
+        call_command('export_stats_data', '--format', 'json.gz', stdout=io.StringIO())
+        self.assertEqual(read_media_json('stats.json.gz')['data']['total_dossiers'], 1)
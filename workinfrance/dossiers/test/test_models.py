@@ -1,10 +1,17 @@
+import copy
 import datetime
 
+from unittest import mock
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
+from workinfrance.dossiers import stats_cache
 from workinfrance.dossiers import utils
-from workinfrance.dossiers.models import Dossier
-from workinfrance.dossiers.test.raw_dossier_fixture import RAW_DOSSIER
+from workinfrance.dossiers.models import DailyStat, Dossier, DossierPayload
+from workinfrance.dossiers.raw_dossier import RAW_DOSSIER
 
 
 class DossierTest(TestCase):
@@ -29,6 +36,10 @@ class DossierTest(TestCase):
         """
         # Test "real" model fields.
         self.assertEqual(self.dossier.status, Dossier.STATUS_CLOSED)
+        self.assertEqual(self.dossier.nationality, 'FRANCE')
+        self.assertEqual(self.dossier.residence_permit_expiration_date, datetime.date(2018, 5, 10))
+        self.assertEqual(self.dossier.apt_start_date, datetime.date(2018, 3, 27))
+        self.assertEqual(self.dossier.apt_end_date, datetime.date(2018, 5, 10))
 
         # Test attributes that are dynamically set to facilitate access to data stored in raw_json.
         self.assertEqual(self.dossier.email, 'john@doe.com')
@@ -72,6 +83,124 @@ class DossierTest(TestCase):
         self.assertEqual(self.dossier.salarie, None)
         self.assertEqual(self.dossier.document_autorisant_le_sejour_en_france, None)
 
+    def test_lazy_attributes(self):
+        """
+        Attributes giving access to raw_json and champs_json subfields are only computed when read.
+        """
+        dossier = Dossier.objects.get(pk=self.dossier.pk)
+        self.assertNotIn('date_de_fin_apt', vars(dossier))
+        self.assertNotIn('email', vars(dossier))
+
+        self.assertEqual(dossier.date_de_fin_apt, datetime.date(2018, 5, 10))
+        self.assertEqual(vars(dossier)['date_de_fin_apt'], datetime.date(2018, 5, 10))
+        self.assertNotIn('date_de_debut_apt', vars(dossier))
+
+        with self.assertRaises(AttributeError):
+            Dossier(pk=1, raw_json={'dossier': {}}, champs_json={}).email
+
+    def test_defer_raw_json(self):
+        with self.assertNumQueries(1):
+            dossier = Dossier.objects.defer_raw_json('accompagnateurs').get(pk=self.dossier.pk)
+            self.assertEqual(dossier.accompagnateurs, ['accompagnateur@direccte.gouv.fr'])
+            self.assertEqual(dossier.date_de_fin_apt, datetime.date(2018, 5, 10))
+        # raw_json is still loaded on demand.
+        with self.assertNumQueries(1):
+            self.assertEqual(dossier.email, 'john@doe.com')
+
+    def test_upsert(self):
+        raw_json = copy.deepcopy(RAW_DOSSIER)
+        raw_json['dossier']['id'] = 44951
+        row = {
+            'ds_id': 44951,
+            'status': Dossier.STATUS_INITIATED,
+            'created_at': self.dossier.created_at,
+            'updated_at': self.dossier.updated_at,
+            'department': '75 - Paris',
+            'raw_json': raw_json,
+        }
+        row.update(Dossier.derive_fields(raw_json))
+        self.assertEqual(Dossier.objects.upsert([row]), 1)
+        self.assertEqual(Dossier.objects.get(ds_id=44951).nom_de_lemployeur, 'Morane')
+
+        # A stored dossier is only updated when its raw JSON changed, and not by an older row.
+        self.assertEqual(Dossier.objects.upsert([row]), 0)
+        raw_json['dossier']['state'] = row['status'] = Dossier.STATUS_REFUSED
+        row.update(Dossier.derive_fields(raw_json))
+        row['updated_at'] -= datetime.timedelta(seconds=1)
+        self.assertEqual(Dossier.objects.upsert([row]), 0)
+        row['updated_at'] += datetime.timedelta(seconds=1)
+        self.assertEqual(Dossier.objects.upsert([row, row]), 1)
+        self.assertEqual(Dossier.objects.get(ds_id=44951).status, Dossier.STATUS_REFUSED)
+        self.assertEqual(Dossier.objects.get(ds_id=44951).raw_json['dossier']['state'], Dossier.STATUS_REFUSED)
+        self.assertEqual(Dossier.objects.count(), 2)
+
+    def test_copy_upsert(self):
+        raw_json = copy.deepcopy(RAW_DOSSIER)
+        raw_json['dossier']['id'] = 44951
+        row = {
+            'ds_id': 44951,
+            'status': Dossier.STATUS_INITIATED,
+            'created_at': self.dossier.created_at,
+            'updated_at': self.dossier.updated_at,
+            'department': '75 - Paris',
+            'raw_json': raw_json,
+        }
+        row.update(Dossier.derive_fields(raw_json))
+        # Cached stats are invalidated once, not by the COPY to the staging table.
+        with mock.patch.object(stats_cache, 'bump_data_version') as bump_data_version:
+            self.assertEqual(Dossier.objects.copy_upsert([row]), 1)
+        bump_data_version.assert_called_once_with(using='default')
+        self.assertEqual(Dossier.objects.get(ds_id=44951).raw_json, raw_json)
+        # Staged rows don't use values of the `id` sequence.
+        self.assertEqual(Dossier.objects.create(
+            ds_id=44952, status=Dossier.STATUS_INITIATED, created_at=self.dossier.created_at,
+            department='75 - Paris', raw_json=RAW_DOSSIER,
+        ).pk, Dossier.objects.get(ds_id=44951).pk + 1)
+
+    def test_payload(self):
+        """
+        raw_json is stored in a separate table, only read on access.
+        """
+        self.assertEqual(DossierPayload.objects.get(dossier=self.dossier).raw_json, RAW_DOSSIER)
+        with CaptureQueriesContext(connection) as queries:
+            dossier = Dossier.objects.get(pk=self.dossier.pk)
+        self.assertNotIn('raw_json', queries[0]['sql'])
+        with self.assertNumQueries(1):
+            self.assertEqual(dossier.raw_json, RAW_DOSSIER)
+            self.assertEqual(dossier.email, 'john@doe.com')
+
+        # Saving a dossier only writes its payload if raw_json changed.
+        with CaptureQueriesContext(connection) as queries:
+            dossier.save()
+        self.assertFalse([query for query in queries if DossierPayload._meta.db_table in query['sql']])
+        raw_json = copy.deepcopy(RAW_DOSSIER)
+        raw_json['dossier']['state'] = Dossier.STATUS_REFUSED
+        dossier.raw_json = raw_json
+        dossier.save()
+        self.assertEqual(Dossier.objects.get(pk=dossier.pk).raw_json, raw_json)
+        self.assertEqual(DossierPayload.objects.count(), 1)
+
+        # Changes made in place are saved too.
+        dossier = Dossier.objects.get(pk=dossier.pk)
+        dossier.raw_json['dossier']['champs_private'][1]['value'] = '2018-06-30'
+        dossier.save()
+        dossier = Dossier.objects.get(pk=dossier.pk)
+        self.assertEqual(dossier.raw_json['dossier']['champs_private'][1]['value'], '2018-06-30')
+        self.assertEqual(dossier.apt_end_date, datetime.date(2018, 6, 30))
+        self.assertEqual(dossier.payload_hash, utils.json_hash(dossier.raw_json))
+
+        # Payloads are deleted with their dossier.
+        dossier.delete()
+        self.assertEqual(DossierPayload.objects.count(), 0)
+
+    def test_watch_before_renew(self):
+        self.assertEqual(list(Dossier.prefecture_objects.watch_before_renew()), [])
+
+        Dossier.objects.filter(pk=self.dossier.pk).update(
+            residence_permit_expiration_date=datetime.date.today() + datetime.timedelta(days=10)
+        )
+        self.assertEqual(list(Dossier.prefecture_objects.watch_before_renew()), [self.dossier])
+
     def test_has_expired(self):
         today = datetime.date.today()
         yesterday = today - datetime.timedelta(days=1)
@@ -132,3 +261,201 @@ class DossierStaticTest(TestCase):
             'document_autorisant_le_sejour_en_france': None
         }
         self.assertEqual(reformated_json, expected_result)
+
+
+class StatsQueriesTest(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        stats_cache.get_cache().clear()
+        now = timezone.now()
+        for ds_id, status, days_ago, nationalite in [
+            (1, Dossier.STATUS_CLOSED, 1, 'MAROC'),
+            (2, Dossier.STATUS_CLOSED, 2, 'MAROC'),
+            (3, Dossier.STATUS_INITIATED, 2, 'ALGERIE'),
+            (4, Dossier.STATUS_CLOSED, 60, 'ALGERIE'),
+            (5, Dossier.STATUS_REFUSED, 400, 'MAROC'),
+            (6, Dossier.STATUS_CLOSED, 500, None),
+        ]:
+            raw_json = copy.deepcopy(RAW_DOSSIER)
+            raw_json['dossier']['id'] = ds_id
+            for champ in raw_json['dossier']['champs']:
+                if champ['type_de_champ']['libelle'] == 'Nationalité':
+                    champ['value'] = nationalite
+            created_at = now - datetime.timedelta(days=days_ago)
+            Dossier.objects.create(
+                ds_id=ds_id,
+                status=status,
+                created_at=created_at,
+                updated_at=created_at + datetime.timedelta(days=ds_id),
+                department='75 - Paris',
+                raw_json=raw_json,
+            )
+
+    def test_get_all_stats(self):
+        with self.assertNumQueries(1):
+            stats = Dossier.stats_objects.get_all_stats()
+
+        self.assertEqual(stats['num_by_day'], Dossier.stats_objects.get_num_by_day())
+        self.assertEqual(stats['num_by_month'], Dossier.stats_objects.get_num_by_month())
+        self.assertEqual(stats['num_by_status'], Dossier.stats_objects.get_num_by_status())
+        self.assertEqual(stats['num_by_country'], Dossier.stats_objects.get_num_by_country())
+        self.assertEqual(list(stats['num_by_country']), ['MAROC', 'ALGERIE', None])
+
+        closed_dossiers = Dossier.stats_objects.filter(status=Dossier.STATUS_CLOSED)
+        self.assertEqual(stats['time_to_process_by_month'], closed_dossiers.get_time_to_process_by_month())
+        self.assertEqual(stats['time_to_process'], closed_dossiers.get_time_to_process())
+        self.assertEqual(stats['time_to_process'], datetime.timedelta(days=13 / 4))
+        distribution = closed_dossiers.get_time_to_process_distribution()
+        self.assertEqual(stats['time_to_process_median'], distribution['median'])
+        self.assertEqual(stats['time_to_process_p90'], distribution['p90'])
+        self.assertEqual(stats['time_to_process_p99'], distribution['p99'])
+        self.assertEqual(stats['total_dossiers'], 6)
+        self.assertEqual(stats['total_dossiers_closed'], 4)
+
+        # Filters of the queryset are taken into account.
+        stats = Dossier.stats_objects.filter(nationality='MAROC').get_all_stats()
+        self.assertEqual(stats['total_dossiers'], 3)
+        self.assertEqual(stats['num_by_country'], {'MAROC': 3})
+
+    def test_get_num_by_with_breakdown(self):
+        Dossier.objects.filter(ds_id__in=[3, 5]).update(department='93 - Seine-Saint-Denis')
+
+        # Filters of the queryset are taken into account.
+        num_by_status = Dossier.stats_objects.filter(department='75 - Paris').get_num_by_status()
+        self.assertEqual(num_by_status[Dossier.STATUS_CLOSED], 4)
+        self.assertEqual(sum(num_by_status.values()), 4)
+
+        with self.assertNumQueries(1):
+            num_by_status = Dossier.stats_objects.get_num_by_status(by='department')
+        self.assertEqual(num_by_status, {
+            '75 - Paris': {
+                'draft': 0, 'initiated': 0, 'received': 0, 'closed': 4, 'refused': 0, 'without_continuation': 0,
+            },
+            '93 - Seine-Saint-Denis': {
+                'draft': 0, 'initiated': 1, 'received': 0, 'closed': 0, 'refused': 1, 'without_continuation': 0,
+            },
+        })
+
+        with self.assertNumQueries(1):
+            num_by_country = Dossier.stats_objects.get_num_by_country(by='department')
+        self.assertEqual(num_by_country, {
+            '75 - Paris': {'MAROC': 2, 'ALGERIE': 1, None: 0},
+            '93 - Seine-Saint-Denis': {'MAROC': 1, 'ALGERIE': 1, None: 0},
+        })
+        self.assertEqual(list(num_by_country['93 - Seine-Saint-Denis']), ['MAROC', 'ALGERIE', None])
+
+        with self.assertNumQueries(1):
+            num_by_month = Dossier.stats_objects.get_num_by_month(by='department')
+        num_by_month_paris = num_by_month['75 - Paris']
+        self.assertIn(len(num_by_month_paris), (12, 13))
+        self.assertEqual(sum(num_by_month_paris.values()), 3)
+        self.assertEqual(
+            {month: total for month, total in num_by_month_paris.items() if total},
+            Dossier.stats_objects.filter(department='75 - Paris').get_num_by_month(),
+        )
+        self.assertEqual(list(num_by_month['93 - Seine-Saint-Denis']), list(num_by_month_paris))
+        self.assertEqual(sum(num_by_month['93 - Seine-Saint-Denis'].values()), 1)
+
+    def test_get_time_to_process_distribution(self):
+        # Closed dossiers were processed in 1, 2, 4 and 6 days.
+        distribution = Dossier.stats_objects.filter(status=Dossier.STATUS_CLOSED).get_time_to_process_distribution()
+        self.assertEqual(distribution, {
+            'average': datetime.timedelta(days=3.25),
+            'median': datetime.timedelta(days=3),
+            'p90': datetime.timedelta(days=5.4),
+            'p99': datetime.timedelta(days=5.94),
+        })
+        self.assertEqual(Dossier.stats_objects.none().get_time_to_process(), None)
+
+    def test_daily_stats(self):
+        DailyStat.objects.rebuild()
+        with self.assertNumQueries(5):
+            stats = DailyStat.objects.get_all_stats()
+        self.assertEqual(stats, Dossier.stats_objects.get_all_stats())
+        self.assertEqual(DailyStat.objects.get_num_by_day(), Dossier.stats_objects.get_num_by_day())
+        self.assertEqual(DailyStat.objects.get_num_by_month(), Dossier.stats_objects.get_num_by_month())
+        self.assertEqual(DailyStat.objects.get_num_by_status(), Dossier.stats_objects.get_num_by_status())
+        self.assertEqual(DailyStat.objects.get_num_by_country(), Dossier.stats_objects.get_num_by_country())
+        self.assertEqual(
+            DailyStat.objects.filter(status=Dossier.STATUS_CLOSED).get_time_to_process(),
+            datetime.timedelta(days=13 / 4),
+        )
+
+    def test_daily_stats_refresh_days(self):
+        DailyStat.objects.rebuild()
+        DailyStat.objects.update(total=0)
+        # Non-consecutive days: only those days are recomputed.
+        now = timezone.now()
+        days = [timezone.localtime(now - datetime.timedelta(days=days_ago)).date() for days_ago in (1, 2, 60)]
+        DailyStat.objects.refresh_days(days)
+        self.assertEqual(
+            sorted(DailyStat.objects.filter(total__gt=0).values_list('day', flat=True).distinct()), sorted(days))
+        self.assertEqual(
+            DailyStat.objects.filter(day__in=days).get_num_by_status(),
+            Dossier.stats_objects.filter(created_at__gt=now - datetime.timedelta(days=61)).get_num_by_status(),
+        )
+
+    def test_daily_stats_refresh(self):
+        DailyStat.objects.rebuild()
+        closed = Dossier.STATUS_CLOSED
+
+        # Rollups are refreshed when a Dossier is saved or deleted.
+        dossier = Dossier.objects.get(ds_id=3)
+        dossier.status = closed
+        dossier.save()
+        self.assertEqual(DailyStat.objects.get_num_by_status()[closed], 5)
+        dossier.created_at -= datetime.timedelta(days=20)
+        dossier.save()
+        self.assertEqual(DailyStat.objects.get_num_by_status(), Dossier.stats_objects.get_num_by_status())
+        self.assertEqual(DailyStat.objects.get_num_by_day(), Dossier.stats_objects.get_num_by_day())
+        dossier.delete()
+        self.assertEqual(DailyStat.objects.get_num_by_status()[closed], 4)
+
+        # And when Dossiers are updated or deleted in bulk (e.g. the "delete selected" admin action).
+        Dossier.objects.filter(ds_id=5).update(status=closed)
+        self.assertEqual(DailyStat.objects.get_num_by_status()[closed], 5)
+        Dossier.objects.filter(ds_id__in=[4, 5]).update(created_at=timezone.now() - datetime.timedelta(days=3))
+        self.assertEqual(DailyStat.objects.get_num_by_day(), Dossier.stats_objects.get_num_by_day())
+        self.assertEqual(DailyStat.objects.get_num_by_month(), Dossier.stats_objects.get_num_by_month())
+        Dossier.objects.filter(ds_id__in=[1, 2]).delete()
+        self.assertEqual(DailyStat.objects.get_num_by_status(), Dossier.stats_objects.get_num_by_status())
+        self.assertEqual(DailyStat.objects.get_num_by_status()[closed], 3)
+
+        # Only the days of the Dossiers written by other means since the last refresh are recomputed.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {Dossier._meta.db_table} SET status = %s, updated_at = CLOCK_TIMESTAMP() WHERE ds_id = 6",
+                [Dossier.STATUS_REFUSED],
+            )
+        self.assertEqual(DailyStat.objects.get_num_by_status()[closed], 3)
+        self.assertEqual(DailyStat.objects.refresh_since_last(), 1)
+        self.assertEqual(DailyStat.objects.get_num_by_status(), Dossier.stats_objects.get_num_by_status())
+        self.assertEqual(DailyStat.objects.get_num_by_status()[closed], 2)
+
+    def test_cached_stats(self):
+        # Tests don't use the cache of the application.
+        self.assertEqual(stats_cache.get_cache().__class__.__name__, 'LocMemCache')
+        with self.assertNumQueries(1):
+            self.assertEqual(Dossier.stats_objects.get_num_by_status()[Dossier.STATUS_CLOSED], 4)
+        with self.assertNumQueries(0):
+            self.assertEqual(Dossier.stats_objects.get_num_by_status()[Dossier.STATUS_CLOSED], 4)
+        # The key depends on the queryset.
+        with self.assertNumQueries(1):
+            Dossier.stats_objects.filter(department='75 - Paris').get_num_by_status()
+
+        # Stats are invalidated when Dossiers are written.
+        Dossier.objects.filter(ds_id=3).update(status=Dossier.STATUS_CLOSED)
+        with self.assertNumQueries(1):
+            self.assertEqual(Dossier.stats_objects.get_num_by_status()[Dossier.STATUS_CLOSED], 5)
+        Dossier.objects.get(ds_id=3).delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(Dossier.stats_objects.get_num_by_status()[Dossier.STATUS_CLOSED], 4)
+        Dossier.objects.filter(status=Dossier.STATUS_CLOSED).delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(Dossier.stats_objects.get_num_by_status().get(Dossier.STATUS_CLOSED, 0), 0)
+
+        # Each DB has its own data version.
+        version = stats_cache.get_data_version()
+        with mock.patch.object(stats_cache, 'get_db_name', return_value='other'):
+            self.assertNotEqual(stats_cache.get_data_version(), version)
@@ -29,6 +29,26 @@ class UtilsTest(TestCase):
         expected_result = '*m** ******'
         self.assertEqual(obfuscated_string, expected_result)
 
+    def test_obfuscate_many(self):
+        strings = [' Emma Louise    ', 'Emma', 'Emma', 'Jo', 'J', '', 'Élise-Anne']
+        self.assertEqual(utils.obfuscate_many(strings), [utils.obfuscate(string) for string in strings])
+
+    def test_parse_dates_many(self):
+        json_dates = ['2018-03-27', '2018-3-27', '2018-02-30', 'lundi', '', None, ['2018-03-27'], '2018-03-27']
+        self.assertEqual(
+            utils.parse_dates_many(json_dates),
+            [datetime.date(2018, 3, 27), datetime.date(2018, 3, 27), None, None, None, None, None,
+             datetime.date(2018, 3, 27)],
+        )
+        # Same results as `json_date_to_python_or_none`, including for values accepted by `int()`.
+        json_dates = [
+            '2018-+3-27', '2018- 3-27', '2_18-03-27', '2018-03-2 ', '+018-03-27', '٢٠١٨-٠٣-٢٧', '2018-03-²7',
+        ]
+        self.assertEqual(
+            utils.parse_dates_many(json_dates),
+            [utils.json_date_to_python_or_none(json_date) for json_date in json_dates],
+        )
+
     def test_daterange(self):
         from_datetime = datetime.datetime(2018, 4, 1)
         to_datetime = datetime.datetime(2018, 4, 10)
@@ -46,3 +66,18 @@ class UtilsTest(TestCase):
             datetime.date(2018, 4, 10),
         ]
         self.assertEqual(result, expected_result)
+
+    def test_monthrange(self):
+        result = list(utils.monthrange(datetime.datetime(2018, 11, 15), datetime.datetime(2019, 2, 1)))
+        expected_result = [
+            datetime.datetime(2018, 11, 1),
+            datetime.datetime(2018, 12, 1),
+            datetime.datetime(2019, 1, 1),
+            datetime.datetime(2019, 2, 1),
+        ]
+        self.assertEqual(result, expected_result)
+
+    def test_chunked(self):
+        result = list(utils.chunked(range(7), 3))
+        self.assertEqual(result, [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(list(utils.chunked([], 3)), [])
@@ -1,11 +1,15 @@
+import copy
 import datetime
+import json
 
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
 
 from workinfrance.dossiers import utils
 from workinfrance.dossiers.models import Dossier
 from workinfrance.dossiers import views
-from workinfrance.dossiers.test.raw_dossier_fixture import RAW_DOSSIER
+from workinfrance.dossiers.raw_dossier import RAW_DOSSIER
 
 
 class ViewsTest(TestCase):
@@ -22,7 +26,9 @@ class ViewsTest(TestCase):
         )
 
     def test_export_data_for_validity_check(self):
-        export_data = views.export_data_for_validity_check()
+        # raw_json is not loaded with an extra query for each dossier.
+        with self.assertNumQueries(1):
+            export_data = views.export_data_for_validity_check()
         expected_result = [
             {
                 'ds_id': 44950,
@@ -36,3 +42,54 @@ class ViewsTest(TestCase):
             },
         ]
         self.assertEqual(export_data, expected_result)
+
+
+class DossierAdminTest(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dossier = Dossier.objects.create(
+            ds_id=RAW_DOSSIER['dossier']['id'],
+            status=RAW_DOSSIER['dossier']['state'],
+            created_at=utils.json_datetime_to_python(RAW_DOSSIER['dossier']['created_at']),
+            updated_at=utils.json_datetime_to_python(RAW_DOSSIER['dossier']['updated_at']),
+            department='75 - Paris',
+            raw_json=RAW_DOSSIER,
+        )
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def test_change_raw_json(self):
+        """
+        Fields derived from the raw JSON are recomputed when it's changed in the admin.
+        """
+        raw_json = copy.deepcopy(RAW_DOSSIER)
+        raw_json['dossier']['champs_private'][1]['value'] = '2018-06-30'
+        url = reverse('admin:dossiers_dossier_change', args=[self.dossier.pk])
+        response = self.client.get(url)
+        self.assertContains(response, 'payload-0-raw_json')
+
+        data = {
+            'ds_id': self.dossier.ds_id,
+            'status': self.dossier.status,
+            'created_at_0': '27/03/2018',
+            'created_at_1': '08:49:51',
+            'updated_at_0': '27/03/2018',
+            'updated_at_1': '09:15:10',
+            'department': self.dossier.department,
+            'payload_hash': self.dossier.payload_hash,
+            'champs_json': json.dumps(self.dossier.champs_json),
+            'payload-TOTAL_FORMS': '1',
+            'payload-INITIAL_FORMS': '1',
+            'payload-MIN_NUM_FORMS': '0',
+            'payload-MAX_NUM_FORMS': '1',
+            'payload-0-dossier': self.dossier.pk,
+            'payload-0-raw_json': json.dumps(raw_json),
+        }
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+
+        dossier = Dossier.objects.get(pk=self.dossier.pk)
+        self.assertEqual(dossier.raw_json, raw_json)
+        self.assertEqual(dossier.apt_end_date, datetime.date(2018, 6, 30))
+        self.assertEqual(dossier.champs_json['date_de_fin_apt'], '2018-06-30')
+        self.assertEqual(dossier.payload_hash, utils.json_hash(raw_json))
@@ -1,4 +1,8 @@
 import datetime
+import hashlib
+import itertools
+import json
+import string
 
 from django.utils import timezone
 
@@ -8,12 +12,64 @@ def json_date_to_python(json_date):
     return datetime.datetime.strptime(json_date, '%Y-%m-%d').date()
 
 
+def json_date_to_python_or_none(json_date):
+    """Convert the given `json_date` to a date object, or return None if it's not a valid JSON date."""
+    try:
+        return json_date_to_python(json_date)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_dates_many(json_dates):
+    """
+    Convert all the given `json_dates` to date objects, or None if they're not valid JSON dates. Return a list.
+
+    Faster than calling `json_date_to_python_or_none` for each value: the fixed `%Y-%m-%d` format is sliced
+    instead of being parsed by `strptime`, and repeated values are converted once.
+    """
+    cache = {}
+    dates = []
+    for json_date in json_dates:
+        try:
+            date = cache[json_date]
+        except KeyError:
+            date = cache[json_date] = _parse_date(json_date)
+        except TypeError:
+            # Unhashable, thus not a string.
+            date = None
+        dates.append(date)
+    return dates
+
+
+def _parse_date(json_date):
+    if isinstance(json_date, str) and len(json_date) == 10 and json_date[4] == '-' and json_date[7] == '-':
+        year, month, day = json_date[:4], json_date[5:7], json_date[8:]
+        # Only ASCII digits, like `strptime`: `int()` also accepts signs, spaces, underscores and other digits.
+        if not (year + month + day).strip(string.digits):
+            try:
+                return datetime.date(int(year), int(month), int(day))
+            except ValueError:
+                pass
+    # Not in the fixed format: let `strptime` decide.
+    return json_date_to_python_or_none(json_date)
+
+
 def json_datetime_to_python(json_datetime):
     """Convert the given `json_datetime` to a datetime object."""
     dt = datetime.datetime.strptime(json_datetime, "%Y-%m-%dT%H:%M:%S.%fZ")
     return timezone.make_aware(dt, timezone.utc)
 
 
+def canonical_json(value):
+    """Serialize `value` to JSON with sorted keys and no whitespace, so that equal values give the same text."""
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def json_hash(value):
+    """Return the SHA-1 hex digest of the canonical JSON of `value`, see `canonical_json`."""
+    return hashlib.sha1(canonical_json(value).encode()).hexdigest()
+
+
 def obfuscate(string):
     """Obfuscate a string by replacing all its characters except the second one."""
     obfuscation_char = '*'
@@ -24,8 +80,64 @@ def obfuscate(string):
         for i, char in enumerate(string.strip(), start=1)
     )
 
+
+class _ObfuscationTable(dict):
+    """Translation table (see `str.translate`) replacing all characters by '*', except spaces."""
+
+    def __missing__(self, key):
+        return '*'
+
+
+OBFUSCATION_TABLE = _ObfuscationTable({ord(' '): ' '})
+
+
+def obfuscate_many(strings):
+    """
+    Obfuscate all the given `strings` like `obfuscate`. Return a list.
+
+    Faster than calling `obfuscate` for each string: characters are replaced by a precomputed mask
+    (or by `str.translate` for strings containing spaces) instead of a Python loop,
+    and repeated strings (e.g. common first names) are obfuscated once.
+    """
+    cache = {}
+    obfuscated_strings = []
+    for string in strings:
+        obfuscated = cache.get(string)
+        if obfuscated is None:
+            stripped = string.strip()
+            masked = stripped.translate(OBFUSCATION_TABLE) if ' ' in stripped else '*' * len(stripped)
+            obfuscated = cache[string] = masked[:1] + stripped[1:2] + masked[2:]
+        obfuscated_strings.append(obfuscated)
+    return obfuscated_strings
+
+
 def daterange(from_datetime, to_datetime):
     """Return all day-dates between two dates as datetime.date objects."""
     delta = to_datetime - from_datetime
     for i in range(delta.days + 1):
         yield (from_datetime + datetime.timedelta(days=i)).date()
+
+
+def monthrange(from_datetime, to_datetime):
+    """
+    Return the first day of all months between two datetimes as datetime.datetime objects (at midnight).
+    Aware datetimes are converted to the current time zone, and aware datetimes are returned.
+    """
+    aware = timezone.is_aware(from_datetime)
+    if aware:
+        from_datetime = timezone.localtime(from_datetime)
+        to_datetime = timezone.localtime(to_datetime)
+    year, month = from_datetime.year, from_datetime.month
+    while (year, month) <= (to_datetime.year, to_datetime.month):
+        dt = datetime.datetime(year, month, 1)
+        yield timezone.make_aware(dt) if aware else dt
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def chunked(iterable, size):
+    """Split the given `iterable` into lists of at most `size` items."""
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
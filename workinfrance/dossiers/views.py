@@ -6,17 +6,51 @@ def export_data_for_validity_check():
     """
     Return a list of closed Dossiers (i.e. accepted) to be used in the validity check UI.
     """
-    closed_dossiers = Dossier.objects.filter(status=Dossier.STATUS_CLOSED)
+    return list(iter_data_for_validity_check())
+
+
+def iter_data_for_validity_check(chunk_size=2000):
+    """
+    Yield the closed Dossiers (i.e. accepted) to be used in the validity check UI, see `export_data_for_validity_check`.
+    Dossiers are ordered by `ds_id`.
+
+    Dossiers are fetched `chunk_size` at a time with a server-side cursor and are not cached by the queryset:
+    memory usage doesn't depend on the number of closed Dossiers.
+    Names and dates of each chunk are converted a whole column at a time (see `utils.obfuscate_many`).
+    """
+    # Only `etablissement` is needed from raw_json.
+    closed_dossiers = (
+        Dossier.objects.filter(status=Dossier.STATUS_CLOSED).order_by('ds_id').defer_raw_json('etablissement')
+    )
+    for dossiers in utils.chunked(closed_dossiers.iterator(chunk_size=chunk_size), chunk_size):
+        champs = [dossier.champs_json for dossier in dossiers]
+        prenoms = utils.obfuscate_many(item['prenom'] for item in champs)
+        noms = utils.obfuscate_many(item['nom'] for item in champs)
+        dates_de_naissance = parse_champs_dates(item['date_de_naissance'] for item in champs)
+        dates_de_debut_apt = parse_champs_dates(item['date_de_debut_apt'] for item in champs)
+        dates_de_fin_apt = parse_champs_dates(item['date_de_fin_apt'] for item in champs)
+        for i, dossier in enumerate(dossiers):
+            # Set the attribute used by `has_expired()`, so that it's not converted again.
+            dossier.date_de_fin_apt = dates_de_fin_apt[i]
+            yield {
+                'ds_id': dossier.ds_id,
+                'siret': dossier.etablissement['siret'],
+                'prenom': prenoms[i],
+                'nom': noms[i],
+                'date_de_naissance': dates_de_naissance[i],
+                'has_expired': dossier.has_expired(),
+                'date_de_debut_apt': dates_de_debut_apt[i],
+                'date_de_fin_apt': dates_de_fin_apt[i],
+            }
+
+
+def parse_champs_dates(json_dates):
+    """
+    Convert the given `champs_json` values to dates with `utils.parse_dates_many`.
+    Like the Dossier attributes, values that are not valid dates are kept as is.
+    """
+    json_dates = list(json_dates)
     return [
-        {
-            'ds_id': dossier.ds_id,
-            'siret': dossier.etablissement['siret'],
-            'prenom': utils.obfuscate(dossier.prenom),
-            'nom': utils.obfuscate(dossier.nom),
-            'date_de_naissance': dossier.date_de_naissance,
-            'has_expired': dossier.has_expired(),
-            'date_de_debut_apt': dossier.date_de_debut_apt,
-            'date_de_fin_apt': dossier.date_de_fin_apt,
-        }
-        for dossier in closed_dossiers
+        date if date is not None else json_date
+        for date, json_date in zip(utils.parse_dates_many(json_dates), json_dates)
     ]
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -120,7 +121,33 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'workinfrance/static/')
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'workinfrance/media/')
 
+# Cache
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Results of stats queries, shared between runs of management commands.
+    'stats': {
+        'BACKEND': os.environ.get('STATS_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('STATS_CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'workinfrance_stats')),
+        'TIMEOUT': 60 * 60 * 24 * 2,
+    },
+}
+
+# Tests use a local memory `stats` cache.
+TEST_RUNNER = 'workinfrance.test_runner.TestRunner'
+
 # Settings for demarches-simplifiees.fr (DS)
 DS_PROCEDURE_ID_APT = os.environ.get('DEMARCHES_SIMPLIFIEES_PROCEDURE_ID_APT')
 DS_API_TOKEN = os.environ.get('DEMARCHES_SIMPLIFIEES_API_TOKEN')
 DS_API_BASE_URL = 'https://www.demarches-simplifiees.fr/api/v1'
+# Timeout (in seconds) of HTTP requests to the DS API.
+DS_API_TIMEOUT = int(os.environ.get('DEMARCHES_SIMPLIFIEES_API_TIMEOUT', default=30))
+# Number of retries of a failing HTTP request (connection errors, 429 and 5xx responses).
+DS_API_MAX_RETRIES = int(os.environ.get('DEMARCHES_SIMPLIFIEES_API_MAX_RETRIES', default=5))
+# Exponential backoff between retries: {backoff factor} * (2 ** ({number of retries} - 1)) seconds.
+DS_API_BACKOFF_FACTOR = float(os.environ.get('DEMARCHES_SIMPLIFIEES_API_BACKOFF_FACTOR', default=0.5))
+# Maximum number of keep-alive connections to the DS API.
+DS_API_POOL_SIZE = int(os.environ.get('DEMARCHES_SIMPLIFIEES_API_POOL_SIZE', default=10))
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+# Cache used by tests and benchmarks instead of the (shared) `stats` cache of the application.
+LOCAL_STATS_CACHE = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'workinfrance_stats',
+}
+
+
+def local_stats_cache_settings():
+    """
+    Return an `override_settings` replacing the `stats` cache by a local memory cache, see `LOCAL_STATS_CACHE`.
+    """
+    return override_settings(CACHES={**settings.CACHES, 'stats': LOCAL_STATS_CACHE})
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Run the tests with a local memory `stats` cache: tests clear it, and must not touch the cache of the application.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.stats_cache_settings = local_stats_cache_settings()
+        self.stats_cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.stats_cache_settings.disable()
+        super().teardown_test_environment(**kwargs)